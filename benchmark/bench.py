@@ -0,0 +1,182 @@
+"""
+End-to-end latency benchmark of the message hot path.
+
+Synthetic Telegram updates are driven through ``handle_message`` at a given
+concurrency, against a stub Docker daemon on a unix socket and a stub LLM, and
+the latency percentiles and throughput are reported per scenario and per tool.
+
+    python benchmark/bench.py --requests 200 --concurrency 20 --llm-latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# message -> tool the stub LLM (or the router) answers it with
+SCENARIOS = {
+    "routed_list_containers": "list containers",
+    "routed_stats": "docker stats",
+    "llm_list_containers": "which containers are up right now?",
+    "llm_list_images": "which image versions are stored on this host?",
+    "llm_stats": "how much cpu and memory is each service using?",
+    "llm_chat": "hello there",
+}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def summarize(latencies, elapsed):
+    return {
+        "requests": len(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies, default=0.0),
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+def start_stubs(workdir, args):
+    from heydocker.stubs import docker as stub_docker
+    from heydocker.stubs import llm as stub_llm
+
+    socket_path = os.path.join(workdir, "docker.sock")
+    docker_server = stub_docker.serve(
+        socket_path, containers=args.containers, stats_delay=args.stats_delay
+    )
+    llm_server = stub_llm.serve(port=0, latency=args.llm_latency)
+    for server in (docker_server, llm_server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ["HOME"] = workdir
+    os.environ["DOCKER_HOST"] = f"unix://{socket_path}"
+    os.environ["HEYDOCKER_LLM_BACKEND"] = "http"
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{llm_server.server_port}/v1"
+    os.environ["OPENAI_KEY"] = "bench"
+    os.environ["TELEGRAM_ALLOWED_IDS"] = "1"
+    os.environ.setdefault("HEYDOCKER_INVENTORY", "1" if args.inventory else "0")
+    os.environ.setdefault("HEYDOCKER_STATS_SAMPLER", "1" if args.sampler else "0")
+    os.environ.setdefault("HEYDOCKER_STREAM", "1" if args.stream else "0")
+
+
+async def run_benchmark(args):
+    # imported once the environment points at the stubs
+    from heydocker import main
+    from heydocker.functions.gpt import tool_registry
+    from heydocker.functions.inventory import inventory
+    from heydocker.functions.stats import stats_sampler
+    from heydocker.stubs.telegram import FakeUpdate
+
+    if main.get_inventory_enabled():
+        inventory.start()
+    if main.get_stats_sampler_enabled():
+        stats_sampler.start()
+    # let the background threads catch up before measuring
+    deadline = time.monotonic() + 10
+    while (
+        main.get_inventory_enabled()
+        and not inventory.ready
+        and time.monotonic() < deadline
+    ):
+        await asyncio.sleep(0.05)
+    if main.get_inventory_enabled() and not inventory.ready:
+        print("Inventory not synced after 10s, measuring the API path", file=sys.stderr)
+    if main.get_stats_sampler_enabled():
+        await asyncio.sleep(2)
+
+    scenarios = [name for name in SCENARIOS if not args.only or name in args.only]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = {name: [] for name in scenarios}
+    first_reply = []
+
+    async def send(index):
+        name = scenarios[index % len(scenarios)]
+        update = FakeUpdate(SCENARIOS[name], chat_id=index % args.chats + 1)
+        async with semaphore:
+            update.message.created = time.perf_counter()
+            await main.handle_message(update, None)
+        message = update.message
+        latencies[name].append(message.last_reply - message.created)
+        first_reply.append(message.first_reply - message.created)
+
+    # warm up the connection pools and the schema cache
+    for index in range(len(scenarios)):
+        await send(index)
+    for name in scenarios:
+        latencies[name].clear()
+    first_reply.clear()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(index) for index in range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    main.database.flush()
+    everything = [x for values in latencies.values() for x in values]
+    return {
+        "config": vars(args),
+        "elapsed": elapsed,
+        "overall": summarize(everything, elapsed),
+        "first_reply": summarize(first_reply, elapsed),
+        "scenarios": {name: summarize(values, elapsed) for name, values in latencies.items()},
+        "tools": tool_registry.stats(),
+    }
+
+
+def print_report(report):
+    print(f"{'scenario':<26}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    rows = [("overall", report["overall"]), ("first reply", report["first_reply"])]
+    rows += list(report["scenarios"].items())
+    for name, row in rows:
+        print(
+            f"{name:<26}{row['requests']:>6}"
+            f"{row['p50'] * 1000:>10.1f}{row['p95'] * 1000:>10.1f}"
+            f"{row['p99'] * 1000:>10.1f}{row['throughput']:>10.1f}"
+        )
+    print()
+    print(f"{'tool':<26}{'calls':>6}{'avg ms':>10}{'max ms':>10}{'errors':>10}")
+    for name, row in sorted(report["tools"].items()):
+        print(
+            f"{name:<26}{row['calls']:>6}{row['average'] * 1000:>10.1f}"
+            f"{row['max'] * 1000:>10.1f}{row['errors']:>10}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--chats", type=int, default=10, help="distinct chat ids")
+    parser.add_argument("--containers", type=int, default=10)
+    parser.add_argument("--stats-delay", type=float, default=1.0)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--only", nargs="*", choices=list(SCENARIOS))
+    parser.add_argument("--inventory", action="store_true")
+    parser.add_argument("--sampler", action="store_true")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory(prefix="heydocker-bench-") as workdir:
+        start_stubs(workdir, args)
+        report = asyncio.run(run_benchmark(args))
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
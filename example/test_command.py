@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import sys
 
@@ -11,4 +12,4 @@ if __name__ == "__main__":
 
     # create GPT client
     gpt_client = GPTClient()
-    print(gpt_client.handle_command(message))
+    print(asyncio.run(gpt_client.handle_command(message)))
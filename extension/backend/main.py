@@ -1,15 +1,29 @@
 import os
 import json
-from socketserver import UnixStreamServer, BaseRequestHandler
+import socket
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn, UnixStreamServer
 import configparser
+from urllib.parse import parse_qs
 
-from heydocker.database import Database
+from heydocker.config import get_notify_socket
+from heydocker.database import MAX_PAGE_SIZE, Database
 
 
 # check if database directory exists
 if not os.path.exists(os.path.expanduser("~/.heydocker")):
     os.makedirs(os.path.expanduser("~/.heydocker"))
 database = Database(os.path.expanduser("~/.heydocker/heydocker.db"))
+database.create_table()
+
+# largest request body accepted, bodies are read in CHUNK_SIZE pieces
+MAX_BODY_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# seconds between SSE keep-alive comments, and longest long-poll wait
+KEEP_ALIVE_INTERVAL = 15
+MAX_POLL_TIMEOUT = 60
 
 
 class HTTPMessageBody:
@@ -17,6 +31,100 @@ class HTTPMessageBody:
         self.message = message
 
 
+def get_messages(query):
+    params = {key: int(values[-1]) for key, values in parse_qs(query).items()}
+    messages = database.get(
+        before_id=params.get("before_id"),
+        after_id=params.get("after_id"),
+        limit=params.get("limit", 100),
+    )
+    return {
+        "messages": messages,
+        # cursors for the next page back and the next incremental poll
+        "before_id": messages[-1]["id"] if messages else params.get("before_id"),
+        "after_id": messages[0]["id"] if messages else params.get("after_id"),
+    }
+
+
+class MessageBroadcaster:
+    """
+    Push new messages to waiting clients.
+
+    The bot sends the id of its newest message to the notify socket after each
+    commit. The broadcaster then reads the new rows once and wakes up every
+    waiting client, so the database is queried once per batch instead of once
+    per client poll.
+    """
+
+    def __init__(self, database, notify_socket, history=1000):
+        self.database = database
+        self.notify_socket = notify_socket
+        self.condition = threading.Condition()
+        # recent messages, oldest to newest
+        self.recent = deque(maxlen=history)
+        latest = database.get(limit=1)
+        self.last_id = latest[0]["id"] if latest else 0
+
+    def start(self):
+        if os.path.exists(self.notify_socket):
+            os.remove(self.notify_socket)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(self.notify_socket)
+        threading.Thread(target=self.run, args=(sock,), daemon=True).start()
+
+    def run(self, sock):
+        while True:
+            try:
+                last_id = int(sock.recv(64))
+                if last_id > self.last_id:
+                    self.fetch()
+            except Exception as e:
+                print("Error reading new messages:", e)
+
+    def fetch(self):
+        while True:
+            messages = self.database.get(after_id=self.last_id, limit=MAX_PAGE_SIZE)
+            if not messages:
+                return
+            with self.condition:
+                self.recent.extend(reversed(messages))
+                self.last_id = messages[0]["id"]
+                self.condition.notify_all()
+
+    def wait(self, after_id, timeout):
+        """
+        Wait until messages newer than ``after_id`` exist.
+
+        :return: Messages newer than after_id, newest first.
+        :rtype: list
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.last_id > after_id, timeout)
+            if self.last_id <= after_id:
+                return []
+            if self.recent and self.recent[0]["id"] <= after_id + 1:
+                messages = [x for x in self.recent if x["id"] > after_id]
+                return messages[:100][::-1]
+        # the client is further behind than the recent messages kept in memory
+        return self.database.get(after_id=after_id)
+
+
+broadcaster = MessageBroadcaster(database, get_notify_socket())
+
+
+def poll_messages(query):
+    params = {key: int(values[-1]) for key, values in parse_qs(query).items()}
+    if params.get("after_id") is None:
+        return get_messages(query)
+    timeout = min(params.get("timeout", 25), MAX_POLL_TIMEOUT)
+    messages = broadcaster.wait(params["after_id"], timeout)
+    return {
+        "messages": messages,
+        "before_id": messages[-1]["id"] if messages else None,
+        "after_id": messages[0]["id"] if messages else params["after_id"],
+    }
+
+
 def write_config_file(config_file_path, config_json):
     config = configparser.ConfigParser()
     # check if dir of config file exists
@@ -31,43 +139,132 @@ def write_config_file(config_file_path, config_json):
     config["openai"] = {}
     if config_json.get("openai_api_key") is not None:
         config["openai"]["api_key"] = config_json.get("openai_api_key")
-    with open(config_file_path, "w") as configfile:
+    # written aside and renamed so the bot never reloads a half-written file
+    tmp_path = f"{config_file_path}.tmp"
+    with open(tmp_path, "w") as configfile:
         config.write(configfile)
+    os.replace(tmp_path, config_file_path)
 
 
-class HelloRequestHandler(BaseRequestHandler):
-    def handle(self):
-        try:
-            data = self.request.recv(1024)  # Receive data from the client
-            if data:
-                print(data)
-                received_data = data.decode()
-                print("received_data:", received_data)
-                received_method = received_data.split(" ")[0]
-                print("received_method:", received_method)
-                received_path = received_data.split(" ")[1]
-                print("received_path:", received_path)
-
-                if received_method == 'POST':
-                    received_message = received_data.split("\r\n\r\n")[1]
-                    print("received_message:", received_message)
-                    received_message = json.loads(received_message)
-                    print("received_message:", received_message)
-
-                    if received_path == "/credentials":
-                        write_config_file("/root/.heydocker/credentials", received_message)
-                        response = b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n{\"status\": \"success\"}"
-                        self.request.sendall(response)
-                
-                elif received_path == "/messages":
-                    all_messages = {
-                        'messages': database.get()
-                    }
-                    response = b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n" + json.dumps(all_messages).encode()
-                    self.request.sendall(response)
+class RequestBodyTooLarge(Exception):
+    pass
 
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    # one thread per connection so a slow client never blocks the others
+    daemon_threads = True
+
+
+class HelloRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # close keep-alive connections idle for longer than this
+    timeout = 60
+
+    def address_string(self):
+        # unix socket clients have no address
+        return "backend.sock"
+
+    def log_message(self, format, *args):
+        print("%s - %s" % (self.address_string(), format % args))
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_exactly(self, length, body):
+        if len(body) + length > MAX_BODY_SIZE:
+            raise RequestBodyTooLarge()
+        while length > 0:
+            chunk = self.rfile.read(min(length, CHUNK_SIZE))
+            if not chunk:
+                raise ValueError("Connection closed before the end of the body")
+            body += chunk
+            length -= len(chunk)
+
+    def read_body(self):
+        body = bytearray()
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                length = int(self.rfile.readline().split(b";")[0], 16)
+                if length == 0:
+                    # skip trailers up to the blank line
+                    while self.rfile.readline().strip():
+                        pass
+                    break
+                self._read_exactly(length, body)
+                self.rfile.readline()
+        else:
+            self._read_exactly(int(self.headers.get("Content-Length", 0)), body)
+        return bytes(body)
+
+    def handle_request(self, handler):
+        try:
+            handler()
+        except RequestBodyTooLarge:
+            self.close_connection = True
+            self.send_json(413, {"status": "error", "error": "Request body too large"})
+        except ValueError as e:
+            self.close_connection = True
+            self.send_json(400, {"status": "error", "error": str(e)})
         except Exception as e:
             print("Error processing request:", e)
+            self.send_json(500, {"status": "error", "error": str(e)})
+
+    def do_GET(self):
+        self.handle_request(self.get)
+
+    def do_POST(self):
+        self.handle_request(self.post)
+
+    def get(self):
+        path, _, query = self.path.partition("?")
+        if path == "/messages":
+            self.send_json(200, get_messages(query))
+        elif path == "/messages/poll":
+            self.send_json(200, poll_messages(query))
+        elif path == "/messages/stream":
+            self.stream_messages()
+        else:
+            self.send_json(404, {"status": "error", "error": "Not found"})
+
+    def stream_messages(self):
+        # server-sent events, the connection stays open until the client leaves
+        last_id = self.headers.get("Last-Event-ID")
+        last_id = int(last_id) if last_id else broadcaster.last_id
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            while True:
+                messages = broadcaster.wait(last_id, KEEP_ALIVE_INTERVAL)
+                if messages:
+                    for message in reversed(messages):
+                        self.wfile.write(
+                            f"id: {message['id']}\ndata: {json.dumps(message)}\n\n".encode()
+                        )
+                    last_id = messages[0]["id"]
+                else:
+                    self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+        except OSError:
+            # client gone or stalled, the headers are sent so no error response
+            return
+
+    def post(self):
+        path, _, _ = self.path.partition("?")
+        body = self.read_body()
+        if path == "/credentials":
+            write_config_file("/root/.heydocker/credentials", json.loads(body))
+            self.send_json(200, {"status": "success"})
+        else:
+            self.send_json(404, {"status": "error", "error": "Not found"})
+
 
 def main():
     socket_path = "/run/guest-services/backend.sock"
@@ -79,9 +276,10 @@ def main():
         os.mkdir("/run/guest-services")
 
     print("Starting listening on", socket_path)
+    broadcaster.start()
 
     try:
-        with UnixStreamServer(socket_path, HelloRequestHandler) as server:
+        with ThreadingUnixHTTPServer(socket_path, HelloRequestHandler) as server:
             server.serve_forever()
     except KeyboardInterrupt:
         pass
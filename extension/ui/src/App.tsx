@@ -21,25 +21,68 @@ function useDockerDesktopClient() {
   return client;
 }
 
+type MessagePage = {
+  messages: any[];
+  before_id: number | null;
+  after_id: number | null;
+};
+
 export function App() {
   const [messages, setMessages] = React.useState<any>([]);
+  const [olderId, setOlderId] = React.useState<number | null>(null);
   const ddClient = useDockerDesktopClient();
   const paperRef = useRef(null);
+  // id of the newest message shown, only newer rows are fetched on each poll
+  const lastIdRef = useRef<number | null>(null);
 
   const fetchAndDisplayResponse = async () => {
-    // const result = await ddClient.extension.vm?.service?.get('/hello');
-    const result = (await ddClient.extension.vm?.service?.get("/messages")) as {
-      messages: any[];
-    };
-    setMessages(result.messages.reverse());
+    const lastId = lastIdRef.current;
+    // after the first page, wait on the backend until new messages are pushed
+    const path =
+      lastId === null
+        ? "/messages?limit=100"
+        : `/messages/poll?after_id=${lastId}&timeout=25`;
+    const result = (await ddClient.extension.vm?.service?.get(
+      path
+    )) as MessagePage;
+    if (result.messages.length === 0) {
+      // no history yet, wait for the first message
+      lastIdRef.current = lastId === null ? 0 : lastId;
+      return;
+    }
+    if (lastId === null) {
+      setOlderId(result.before_id);
+    }
+    lastIdRef.current = result.after_id;
+    const newMessages = result.messages.reverse();
+    setMessages((messages: any[]) => messages.concat(newMessages));
   };
 
-  // interval 1s fetch messages
+  const fetchOlderMessages = async () => {
+    const result = (await ddClient.extension.vm?.service?.get(
+      `/messages?before_id=${olderId}&limit=100`
+    )) as MessagePage;
+    setOlderId(result.messages.length > 0 ? result.before_id : null);
+    const olderMessages = result.messages.reverse();
+    setMessages((messages: any[]) => olderMessages.concat(messages));
+  };
+
+  // long-poll loop, retry after 1s when the backend is not reachable
   useEffect(() => {
-    const interval = setInterval(() => {
-      fetchAndDisplayResponse();
-    }, 1000);
-    return () => clearInterval(interval);
+    let active = true;
+    const poll = async () => {
+      while (active) {
+        try {
+          await fetchAndDisplayResponse();
+        } catch (e) {
+          await new Promise((resolve) => setTimeout(resolve, 1000));
+        }
+      }
+    };
+    poll();
+    return () => {
+      active = false;
+    };
   }, []);
 
   useEffect(() => {
@@ -83,10 +126,17 @@ export function App() {
               padding: "10px",
             }}
           >
+            {olderId !== null && (
+              <Button onClick={fetchOlderMessages}>Load older messages</Button>
+            )}
             <List>
               {messages.map((message: any) => {
                 return (
-                  <Message name={message.username} text={message.message} />
+                  <Message
+                    key={message.id}
+                    name={message.username}
+                    text={message.message}
+                  />
                 );
               })}
             </List>
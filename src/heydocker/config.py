@@ -1,40 +1,319 @@
 import configparser
+import logging
 import os
+import threading
+import time
+from typing import FrozenSet, NamedTuple, Optional
 
+logger = logging.getLogger(__name__)
 
-def get_telegram_token():
-    token = os.environ.get("TELEGRAM_TOKEN")
-    # if environ var empty, check ~/.heydocker/credentials
-    if token is None and os.path.exists(os.path.expanduser("~/.heydocker/credentials")):
-        config = configparser.ConfigParser()
-        config.read(os.path.expanduser("~/.heydocker/credentials"))
-        token = config["telegram"]["token"]
+CREDENTIALS_FILE = "~/.heydocker/credentials"
 
-    return token
 
+class Credentials(NamedTuple):
+    telegram_token: Optional[str]
+    allowed_ids: FrozenSet[int]
+    openai_api_key: Optional[str]
+
+
+def load_credentials(path):
+    """
+    Read the credentials, environment variables taking precedence over the
+    credentials file.
+
+    :param path: Credentials file, written by the Docker Desktop extension.
+    :type path: str
+    :rtype: Credentials
+    """
+    config = configparser.ConfigParser()
+    if os.path.exists(path):
+        config.read(path)
+
+    token = os.environ.get("TELEGRAM_TOKEN")
+    if token is None:
+        token = config.get("telegram", "token", fallback=None)
 
-def get_telegram_allowed_ids():
     allowed_ids = os.environ.get("TELEGRAM_ALLOWED_IDS")
-    # if environ var empty, check ~/.heydocker/credentials
-    if allowed_ids is None and os.path.exists(
-        os.path.expanduser("~/.heydocker/credentials")
-    ):
-        config = configparser.ConfigParser()
-        config.read(os.path.expanduser("~/.heydocker/credentials"))
-        allowed_ids = config["telegram"]["allowed_ids"]
+    if allowed_ids is None:
+        allowed_ids = config.get("telegram", "allowed_ids", fallback="")
+
+    key = os.environ.get("OPENAI_KEY")
+    if key is None:
+        key = config.get("openai", "api_key", fallback=None)
+
+    return Credentials(
+        telegram_token=token,
+        allowed_ids=frozenset(int(x) for x in allowed_ids.split(",") if x.strip()),
+        openai_api_key=key,
+    )
+
+
+class CredentialsStore:
+    """
+    Credentials loaded once into an immutable snapshot.
+
+    Handlers read ``current`` without touching the filesystem. A background
+    thread polls the mtime of the credentials file and swaps in a new snapshot
+    when the extension rewrites it; a file that fails to parse keeps the
+    previous snapshot.
+    """
+
+    def __init__(self, path, poll_interval=2.0):
+        self.path = os.path.expanduser(path)
+        self.poll_interval = poll_interval
+        self._stamp = self._file_stamp()
+        self.current = load_credentials(self.path)
+        self._lock = threading.Lock()
+        self._thread = None
 
-    allowed_ids = allowed_ids.split(",")
-    print(allowed_ids)
-    print(type(allowed_ids))
-    print("...")
-    return [int(x) for x in allowed_ids]
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def reload_if_changed(self):
+        """
+        :return: Whether a new snapshot was loaded.
+        :rtype: bool
+        """
+        with self._lock:
+            stamp = self._file_stamp()
+            if stamp == self._stamp:
+                return False
+            # a broken file is reported once, not on every poll
+            self._stamp = stamp
+            try:
+                credentials = load_credentials(self.path)
+            except (configparser.Error, ValueError) as e:
+                logger.warning(f"Keeping previous credentials, failed to read {self.path}: {e}")
+                return False
+            self.current = credentials
+        logger.info(f"Reloaded credentials from {self.path}")
+        return True
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="heydocker-credentials", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            self.reload_if_changed()
+
+
+credentials = CredentialsStore(CREDENTIALS_FILE)
+
+
+def get_telegram_token():
+    return credentials.current.telegram_token
+
+
+def get_telegram_allowed_ids():
+    return credentials.current.allowed_ids
 
 
 def get_openai_api_key():
-    key = os.environ.get("OPENAI_KEY")
-    # if environ var empty, check ~/.heydocker/credentials
-    if key is None and os.path.exists(os.path.expanduser("~/.heydocker/credentials")):
-        config = configparser.ConfigParser()
-        config.read(os.path.expanduser("~/.heydocker/credentials"))
-        key = config["openai"]["api_key"]
-    return key
+    return credentials.current.openai_api_key
+
+
+def get_docker_pool_size():
+    return int(os.environ.get("HEYDOCKER_DOCKER_POOL_SIZE", 10))
+
+
+def get_docker_timeout():
+    return int(os.environ.get("HEYDOCKER_DOCKER_TIMEOUT", 60))
+
+
+def get_tool_workers():
+    return int(os.environ.get("HEYDOCKER_TOOL_WORKERS", 8))
+
+
+def get_concurrent_updates():
+    return int(os.environ.get("HEYDOCKER_CONCURRENT_UPDATES", 16))
+
+
+def get_history_size():
+    return int(os.environ.get("HEYDOCKER_HISTORY_SIZE", 8))
+
+
+def get_max_conversations():
+    return int(os.environ.get("HEYDOCKER_MAX_CONVERSATIONS", 1000))
+
+
+def get_conversation_idle_timeout():
+    return int(os.environ.get("HEYDOCKER_CONVERSATION_IDLE_TIMEOUT", 24 * 60 * 60))
+
+
+def get_persist_conversations():
+    return os.environ.get("HEYDOCKER_PERSIST_CONVERSATIONS", "1") == "1"
+
+
+def get_db_flush_interval():
+    return float(os.environ.get("HEYDOCKER_DB_FLUSH_INTERVAL", 0.5))
+
+
+def get_db_flush_size():
+    return int(os.environ.get("HEYDOCKER_DB_FLUSH_SIZE", 100))
+
+
+def get_notify_socket():
+    return os.environ.get(
+        "HEYDOCKER_NOTIFY_SOCKET", os.path.expanduser("~/.heydocker/messages.sock")
+    )
+
+
+def get_stats_sampler_enabled():
+    return os.environ.get("HEYDOCKER_STATS_SAMPLER", "1") == "1"
+
+
+def get_stats_history_size():
+    # samples kept per container, docker streams about one sample per second
+    return int(os.environ.get("HEYDOCKER_STATS_HISTORY_SIZE", 300))
+
+
+def get_inventory_enabled():
+    return os.environ.get("HEYDOCKER_INVENTORY", "1") == "1"
+
+
+def get_cache_dir():
+    return os.environ.get(
+        "HEYDOCKER_CACHE_DIR", os.path.expanduser("~/.heydocker/cache")
+    )
+
+
+def get_openai_model():
+    # the model has to support parallel tool calls
+    return os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo-0125")
+
+
+def get_max_tool_rounds():
+    return int(os.environ.get("HEYDOCKER_MAX_TOOL_ROUNDS", 5))
+
+
+def get_stream_enabled():
+    return os.environ.get("HEYDOCKER_STREAM", "1") == "1"
+
+
+def get_stream_edit_interval():
+    return float(os.environ.get("HEYDOCKER_STREAM_EDIT_INTERVAL", 1.0))
+
+
+def get_tool_output_budget():
+    # tokens a single tool output may take in the prompt
+    return int(os.environ.get("HEYDOCKER_TOOL_OUTPUT_BUDGET", 1000))
+
+
+def get_prompt_budget():
+    return int(os.environ.get("HEYDOCKER_PROMPT_BUDGET", 3000))
+
+
+def get_router_enabled():
+    return os.environ.get("HEYDOCKER_ROUTER", "1") == "1"
+
+
+def get_router_threshold():
+    return float(os.environ.get("HEYDOCKER_ROUTER_THRESHOLD", 0.75))
+
+
+def get_llm_backend():
+    # "openai" uses the openai package, "http" any OpenAI-compatible API
+    return os.environ.get("HEYDOCKER_LLM_BACKEND", "openai")
+
+
+def get_openai_api_base():
+    return os.environ.get("OPENAI_API_BASE")
+
+
+def get_llm_timeout():
+    return float(os.environ.get("HEYDOCKER_LLM_TIMEOUT", 60))
+
+
+def get_llm_retries():
+    return int(os.environ.get("HEYDOCKER_LLM_RETRIES", 3))
+
+
+def get_trace_file():
+    # spans are only exported when a file is set, the /stats histogram is always kept
+    return os.environ.get("HEYDOCKER_TRACE_FILE")
+
+
+def get_trace_format():
+    # "jsonl" or "otlp" (OpenTelemetry JSON, one export request per line)
+    return os.environ.get("HEYDOCKER_TRACE_FORMAT", "jsonl")
+
+
+def get_metrics_port():
+    # the Prometheus /metrics endpoint is only served when a port is set
+    port = os.environ.get("HEYDOCKER_METRICS_PORT")
+    return int(port) if port else None
+
+
+def get_metrics_host():
+    return os.environ.get("HEYDOCKER_METRICS_HOST", "0.0.0.0")
+
+
+def get_webhook_url():
+    # public base URL Telegram pushes updates to, long polling is used without it
+    return os.environ.get("HEYDOCKER_WEBHOOK_URL")
+
+
+def get_webhook_listen():
+    return os.environ.get("HEYDOCKER_WEBHOOK_LISTEN", "0.0.0.0")
+
+
+def get_webhook_port():
+    return int(os.environ.get("HEYDOCKER_WEBHOOK_PORT", 8443))
+
+
+def get_webhook_path():
+    return os.environ.get("HEYDOCKER_WEBHOOK_PATH", "telegram")
+
+
+def get_webhook_secret():
+    # checked against the X-Telegram-Bot-Api-Secret-Token header of every update
+    return os.environ.get("HEYDOCKER_WEBHOOK_SECRET")
+
+
+def get_webhook_cert():
+    # certificate and key to serve HTTPS directly instead of behind a proxy
+    return os.environ.get("HEYDOCKER_WEBHOOK_CERT")
+
+
+def get_webhook_key():
+    return os.environ.get("HEYDOCKER_WEBHOOK_KEY")
+
+
+def get_restart_max_delay():
+    return float(os.environ.get("HEYDOCKER_RESTART_MAX_DELAY", 300))
+
+
+def get_docker_hosts():
+    # remote daemons as "name=url" pairs, e.g. "web1=tcp://10.0.0.5:2376,db=ssh://admin@db"
+    hosts = os.environ.get("HEYDOCKER_DOCKER_HOSTS", "")
+    pairs = [x.split("=", 1) for x in hosts.split(",") if x.strip()]
+    return {name.strip(): url.strip() for name, url in pairs}
+
+
+def get_docker_cert_path():
+    # <path>/<host name>/{ca,cert,key}.pem enables TLS for that host
+    return os.environ.get("HEYDOCKER_DOCKER_CERT_PATH")
+
+
+def get_host_timeout():
+    # seconds a fleet-wide call waits for each host
+    return float(os.environ.get("HEYDOCKER_HOST_TIMEOUT", 10))
+
+
+def get_log_byte_cap():
+    # bytes of logs container_logs reads at most
+    return int(os.environ.get("HEYDOCKER_LOG_BYTE_CAP", 1024 * 1024))
+
+
+def get_max_concurrent_pulls():
+    # image pulls downloading at once, the others wait in the queue
+    return int(os.environ.get("HEYDOCKER_MAX_CONCURRENT_PULLS", 2))
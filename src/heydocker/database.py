@@ -1,29 +1,255 @@
+import logging
+import queue
+import socket
 import sqlite3
+import threading
+import time
 from typing import Dict
 
+from heydocker.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+_FLUSH = object()
+
+MAX_PAGE_SIZE = 1000
+
 
 class Database:
     # This is a database to store message, each message contain username, and message
+    #
+    # Writes go through a write-behind queue once start_writer() is called: rows are
+    # flushed by a background thread in batched transactions every flush_interval
+    # seconds or flush_size rows, whichever comes first. The database runs in WAL
+    # mode so readers (the extension backend) never block the bot's writes.
+    #
+    # After new messages are committed, the id of the newest one is passed to the
+    # subscribed callbacks and sent as a datagram to notify_socket, so other
+    # processes can push new messages without polling the table.
 
-    def __init__(self, db_file):
+    def __init__(
+        self,
+        db_file,
+        flush_interval=0.5,
+        flush_size=100,
+        notify_socket=None,
+        conversation_size=None,
+    ):
         self.db_file = db_file
-        self.conn = sqlite3.connect(db_file)
+        # conversation rows kept per chat, all of them when None
+        self.conversation_size = conversation_size
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.notify_socket = notify_socket
+        self.conn = self._connect()
         self.cursor = self.conn.cursor()
+        self.lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._writer = None
+        self._listeners = []
+        self._notify_sock = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode NORMAL only fsyncs on checkpoint, never on every commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
 
     def create_table(self):
-        self.cursor.execute(
-            "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, message TEXT)"
-        )
-        self.conn.commit()
-
-    def insert(self, username, message):
-        self.cursor.execute(
-            "INSERT INTO messages (username, message) VALUES (?, ?)",
-            (username, message),
-        )
-        self.conn.commit()
-
-    def get(self) -> Dict:
-        self.cursor.execute("SELECT * FROM messages ORDER BY id DESC LIMIT 100")
-        # return in json format and sorted oldest to newest
-        return [{"id": x[0], "username": x[1], "message": x[2]} for x in self.cursor]
\ No newline at end of file
+        with self.lock:
+            self.cursor.execute(
+                "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, message TEXT, chat_id INTEGER, timestamp REAL)"
+            )
+            # add the columns to databases created by older versions
+            columns = [x[1] for x in self.cursor.execute("PRAGMA table_info(messages)")]
+            if "chat_id" not in columns:
+                self.cursor.execute("ALTER TABLE messages ADD COLUMN chat_id INTEGER")
+            if "timestamp" not in columns:
+                self.cursor.execute("ALTER TABLE messages ADD COLUMN timestamp REAL")
+            self.cursor.execute(
+                "CREATE INDEX IF NOT EXISTS messages_chat_id ON messages (chat_id, id)"
+            )
+            self.cursor.execute(
+                "CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp)"
+            )
+            # conversation history sent to the model, one JSON encoded message per row
+            self.cursor.execute(
+                "CREATE TABLE IF NOT EXISTS conversations (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER, message TEXT)"
+            )
+            self.cursor.execute(
+                "CREATE INDEX IF NOT EXISTS conversations_chat_id ON conversations (chat_id, id)"
+            )
+            self.conn.commit()
+
+    def start_writer(self):
+        """Start the background thread flushing queued rows."""
+        if self._writer is None:
+            self._writer = threading.Thread(
+                target=self._run_writer, name="heydocker-db-writer", daemon=True
+            )
+            self._writer.start()
+
+    def _run_writer(self):
+        conn = self._connect()
+        stopped = False
+        while not stopped:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(items) < self.flush_size and items[-1] not in (_STOP, _FLUSH):
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            stopped = items[-1] is _STOP
+            batch = [item for item in items if item not in (_STOP, _FLUSH)]
+            try:
+                self._write(conn, batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} rows: {e}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+        conn.close()
+
+    def _write(self, conn, batch):
+        if not batch:
+            return
+        messages = [row for table, row in batch if table == "messages"]
+        conversations = [row for table, row in batch if table == "conversations"]
+        with tracer.span(
+            "database.write", messages=len(messages), conversations=len(conversations)
+        ), conn:
+            if messages:
+                conn.executemany(
+                    "INSERT INTO messages (username, message, chat_id, timestamp) VALUES (?, ?, ?, ?)",
+                    messages,
+                )
+                last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            if conversations:
+                conn.executemany(
+                    "INSERT INTO conversations (chat_id, message) VALUES (?, ?)",
+                    conversations,
+                )
+                if self.conversation_size:
+                    # only the newest rows of a chat are ever read back
+                    conn.executemany(
+                        "DELETE FROM conversations WHERE chat_id = ? AND id <= "
+                        "(SELECT id FROM conversations WHERE chat_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                        [
+                            (chat_id, chat_id, self.conversation_size)
+                            for chat_id in {row[0] for row in conversations}
+                        ],
+                    )
+        if messages:
+            self._notify(last_id)
+
+    def subscribe(self, callback):
+        """
+        Call ``callback(last_id)`` every time new messages are committed.
+
+        :param callback: Function receiving the id of the newest message.
+        :type callback: callable
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, last_id):
+        for callback in self._listeners:
+            try:
+                callback(last_id)
+            except Exception as e:
+                logger.error(f"Message listener failed: {e}")
+
+        if self.notify_socket is None:
+            return
+        if self._notify_sock is None:
+            self._notify_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._notify_sock.setblocking(False)
+        try:
+            self._notify_sock.sendto(str(last_id).encode(), self.notify_socket)
+        except OSError:
+            # nobody is listening, e.g. the extension backend is not running
+            pass
+
+    def _enqueue(self, table, row):
+        if self._writer is None:
+            with self.lock:
+                self._write(self.conn, [(table, row)])
+        else:
+            self._queue.put((table, row))
+
+    def flush(self):
+        """Block until every queued row has been written."""
+        if self._writer is not None:
+            # cut the current batch short instead of waiting for the interval
+            self._queue.put(_FLUSH)
+            self._queue.join()
+
+    def close(self):
+        if self._writer is not None:
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._writer = None
+        if self._notify_sock is not None:
+            self._notify_sock.close()
+        self.conn.close()
+
+    def insert(self, username, message, chat_id=None):
+        with tracer.span("database.insert", queued=self._writer is not None):
+            self._enqueue("messages", (username, message, chat_id, time.time()))
+
+    def get(self, before_id=None, after_id=None, limit=100) -> Dict:
+        """
+        Get logged messages, newest first, using keyset pagination on the id.
+
+        Without a cursor the latest ``limit`` messages are returned. ``before_id``
+        pages back through older history; ``after_id`` returns the oldest ``limit``
+        messages newer than the cursor, so polling with the last seen id only
+        fetches new rows.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        query = "SELECT id, username, message, chat_id, timestamp FROM messages"
+        if after_id is not None:
+            query += " WHERE id > ? ORDER BY id ASC LIMIT ?"
+            params = (int(after_id), limit)
+        elif before_id is not None:
+            query += " WHERE id < ? ORDER BY id DESC LIMIT ?"
+            params = (int(before_id), limit)
+        else:
+            query += " ORDER BY id DESC LIMIT ?"
+            params = (limit,)
+
+        with self.lock:
+            rows = self.cursor.execute(query, params).fetchall()
+        if after_id is not None:
+            rows.reverse()
+
+        return [
+            {
+                "id": x[0],
+                "username": x[1],
+                "message": x[2],
+                "chat_id": x[3],
+                "timestamp": x[4],
+            }
+            for x in rows
+        ]
+
+    def insert_conversation(self, chat_id, message):
+        self._enqueue("conversations", (chat_id, message))
+
+    def get_conversation(self, chat_id, limit):
+        # make sure messages still queued for this chat are visible, this waits
+        # for the writer so it must not run on the event loop
+        self.flush()
+        with self.lock:
+            self.cursor.execute(
+                "SELECT message FROM conversations WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+                (chat_id, limit),
+            )
+            # return oldest to newest
+            return [x[0] for x in self.cursor.fetchall()][::-1]
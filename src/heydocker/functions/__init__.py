@@ -3,5 +3,5 @@ from heydocker.functions.gpt import GPTClient
 gpt_client = GPTClient()
 
 
-def run(message: str):
-    return gpt_client.handle_command(message)
+async def run(message: str, chat_id=None, on_update=None):
+    return await gpt_client.handle_command(message, chat_id, on_update)
@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+
+class ToolCache:
+    """
+    TTL cache for the responses of read-only tools.
+
+    Concurrent identical calls are single-flighted: the first caller runs the
+    tool and the others wait for its result. Cached responses carry tags (e.g.
+    "containers") and are dropped when a mutating tool invalidates one of their
+    tags. A response computed while its tag was invalidated is not stored.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._inflight = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def _generation(self, tags):
+        return tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+            for key in [k for k, v in self._entries.items() if set(v[2]) & set(tags)]:
+                del self._entries[key]
+
+    def handle_event(self, event):
+        """Invalidate on Docker events, catching changes made outside the bot too."""
+        self.invalidate(f"{event['Type']}s")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_call(self, key, ttl, tags, function, *args, **kwargs):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                generation = self._generation(tags)
+
+        if not owner:
+            return future.result()
+
+        try:
+            response = function(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._inflight[key]
+            if generation == self._generation(tags):
+                self._entries[key] = (time.monotonic() + ttl, response, tags)
+        future.set_result(response)
+        return response
+
+    def cached(self, ttl, tags=()):
+        """
+        Cache the responses of a read-only tool for ``ttl`` seconds.
+
+        :param ttl: Seconds a response stays valid.
+        :type ttl: float
+        :param tags: What the response depends on, e.g. "containers".
+        :type tags: tuple
+        """
+
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                key = (function.__name__, args, tuple(sorted(kwargs.items())))
+                return self.get_or_call(key, ttl, tags, function, *args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def invalidates(self, *tags):
+        """Drop the cached responses tagged with ``tags`` after a mutating tool runs."""
+
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.invalidate(*tags)
+
+            return wrapper
+
+        return decorator
+
+
+tool_cache = ToolCache()
@@ -0,0 +1,119 @@
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+
+from heydocker.functions.executor import tool_executor
+
+logger = logging.getLogger(__name__)
+
+
+class Conversation:
+    """Bounded message history of a single chat."""
+
+    def __init__(self, max_messages):
+        self.history = deque(maxlen=max_messages)
+        self.last_used = time.monotonic()
+
+    def window(self):
+        """
+        Get the messages to send to the model.
+
+        Leading assistant/function messages whose user message was pushed out of
+        the ring buffer are dropped so the window always starts with a question.
+
+        :return: Chat messages.
+        :rtype: list
+        """
+        messages = list(self.history)
+        for index, message in enumerate(messages):
+            if message["role"] == "user":
+                return messages[index:]
+        return []
+
+
+class ConversationStore:
+    """
+    Conversations keyed by chat id.
+
+    Each chat keeps a ring buffer of its last ``max_messages`` messages. Idle
+    conversations are evicted least-recently-used first, either when more than
+    ``max_conversations`` are held or after ``idle_timeout`` seconds. With a
+    database attached, messages are persisted and an evicted conversation is
+    restored from it on the next message.
+    """
+
+    def __init__(
+        self, max_messages=4, max_conversations=1000, idle_timeout=86400, database=None
+    ):
+        self.max_messages = max_messages
+        self.max_conversations = max_conversations
+        self.idle_timeout = idle_timeout
+        self.database = database
+        self._conversations = OrderedDict()
+
+    def attach(self, database):
+        self.database = database
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._conversations:
+            chat_id, conversation = next(iter(self._conversations.items()))
+            if (
+                len(self._conversations) <= self.max_conversations
+                and now - conversation.last_used < self.idle_timeout
+            ):
+                break
+            logger.debug(f"Evict conversation {chat_id}")
+            del self._conversations[chat_id]
+
+    def _load(self, chat_id):
+        conversation = Conversation(self.max_messages)
+        if self.database is not None:
+            for message in self.database.get_conversation(chat_id, self.max_messages):
+                conversation.history.append(json.loads(message))
+        return conversation
+
+    async def restore(self, chat_id):
+        """
+        Load the conversation of a chat from the database on the tool executor,
+        so ``get`` finds it in memory instead of waiting on SQLite on the event
+        loop.
+
+        :param chat_id: Telegram chat id.
+        :type chat_id: int
+        """
+        if self.database is None or chat_id in self._conversations:
+            return
+        conversation = await tool_executor.run(self._load, chat_id)
+        # another message of the chat may have created it in the meantime
+        self._conversations.setdefault(chat_id, conversation)
+
+    def get(self, chat_id):
+        """
+        Get the conversation of a chat, creating or restoring it if needed.
+
+        :param chat_id: Telegram chat id.
+        :type chat_id: int
+        :return: Conversation.
+        :rtype: Conversation
+        """
+        conversation = self._conversations.get(chat_id)
+        if conversation is None:
+            conversation = self._conversations[chat_id] = self._load(chat_id)
+        else:
+            self._conversations.move_to_end(chat_id)
+        conversation.last_used = time.monotonic()
+        self._evict()
+        return conversation
+
+    def add_message(self, chat_id, message):
+        self.get(chat_id).history.append(message)
+        if self.database is not None:
+            self.database.insert_conversation(chat_id, json.dumps(message))
+
+    def messages(self, chat_id):
+        return self.get(chat_id).window()
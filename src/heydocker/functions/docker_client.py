@@ -0,0 +1,257 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import wraps
+
+import docker
+from requests.exceptions import ConnectionError as RequestsConnectionError
+
+from heydocker.config import (get_docker_cert_path, get_docker_hosts,
+                              get_docker_pool_size, get_docker_timeout,
+                              get_host_timeout)
+
+logger = logging.getLogger(__name__)
+
+
+class DockerClientManager:
+    """
+    Process-wide Docker client with a keep-alive connection pool.
+
+    The client is created lazily, health-checked with a ping at most once every
+    ``health_check_interval`` seconds and rebuilt when the daemon stops answering,
+    e.g. after the Docker daemon has been restarted. Connecting and the ping
+    run outside the lock with a short timeout, so a hung daemon does not hold
+    up the other callers.
+    """
+
+    def __init__(
+        self,
+        pool_size=10,
+        timeout=60,
+        health_check_interval=30,
+        base_url=None,
+        tls=None,
+        ping_timeout=5,
+    ):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.ping_timeout = ping_timeout
+        # None connects to the daemon configured by the DOCKER_* environment
+        self.base_url = base_url
+        self.tls = tls
+        self._client = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # the API version is negotiated on creation, with the short timeout so a
+        # hung daemon fails fast, the calls then use the regular one
+        if self.base_url is None:
+            logger.info(f"Connecting to Docker daemon (pool size {self.pool_size})")
+            client = docker.from_env(
+                max_pool_size=self.pool_size, timeout=self.ping_timeout
+            )
+        else:
+            logger.info(f"Connecting to Docker daemon at {self.base_url}")
+            client = docker.DockerClient(
+                base_url=self.base_url,
+                tls=self.tls or False,
+                timeout=self.ping_timeout,
+                max_pool_size=self.pool_size,
+                # ssh:// hosts go through the ssh binary, honouring ~/.ssh/config
+                use_ssh_client=self.base_url.startswith("ssh://"),
+            )
+        client.api.timeout = self.timeout
+        return client
+
+    def _close(self):
+        if self._client is not None:
+            try:
+                self._client.close()
+            except Exception as e:
+                logger.debug(f"Error closing Docker client: {e}")
+            self._client = None
+
+    def _ping(self, client):
+        try:
+            api = client.api
+            response = api._get(api._url("/_ping"), timeout=self.ping_timeout)
+            return api._result(response) == "OK"
+        except Exception as e:
+            logger.warning(f"Docker daemon health check failed: {e}")
+            return False
+
+    def get(self):
+        """
+        Get the shared Docker client, reconnecting if the daemon went away.
+
+        :return: Docker client.
+        :rtype: docker.DockerClient
+        """
+        with self._lock:
+            client = self._client
+            if client is not None:
+                now = time.monotonic()
+                if now - self._last_check <= self.health_check_interval:
+                    return client
+                # only this caller checks, the others keep using the current client
+                self._last_check = now
+
+        if client is not None and self._ping(client):
+            return client
+        # connect outside the lock so a hung daemon only holds up this caller
+        new_client = self._connect()
+        with self._lock:
+            if self._client is client:
+                self._close()
+                self._client = new_client
+                self._last_check = time.monotonic()
+                return new_client
+        # connected, reset or replaced by another caller meanwhile
+        new_client.close()
+        return self.get()
+
+    def reset(self):
+        """Drop the current client so the next call reconnects."""
+        with self._lock:
+            self._close()
+
+
+docker_client = DockerClientManager(
+    pool_size=get_docker_pool_size(), timeout=get_docker_timeout()
+)
+
+
+LOCAL_HOST = "local"
+
+
+class HostRegistry:
+    """
+    Docker daemons the bot controls, by name.
+
+    "local" is the daemon of the environment, the others are TCP (with TLS
+    when a certificate directory exists for them) or SSH endpoints. Every host
+    has its own client manager so a slow host never holds the connections of
+    another. ``fan_out`` runs a call on every host concurrently, so a fleet
+    question takes the time of the slowest host rather than the sum.
+    """
+
+    def __init__(self, local, hosts, cert_path=None, timeout=10, pool_size=4):
+        self.timeout = timeout
+        self.managers = {LOCAL_HOST: local}
+        for name, base_url in hosts.items():
+            self.managers[name] = DockerClientManager(
+                pool_size=pool_size,
+                timeout=timeout,
+                base_url=base_url,
+                tls=self._tls_config(cert_path, name),
+            )
+        self._fan_out = ThreadPoolExecutor(
+            max_workers=max(4, 2 * len(self.managers)),
+            thread_name_prefix="heydocker-fleet",
+        )
+
+    @staticmethod
+    def _tls_config(cert_path, name):
+        # same layout as DOCKER_CERT_PATH, one directory per host
+        directory = os.path.join(cert_path, name) if cert_path else None
+        if directory is None or not os.path.isdir(directory):
+            return None
+        return docker.tls.TLSConfig(
+            client_cert=(
+                os.path.join(directory, "cert.pem"),
+                os.path.join(directory, "key.pem"),
+            ),
+            ca_cert=os.path.join(directory, "ca.pem"),
+            verify=True,
+        )
+
+    def names(self):
+        return list(self.managers)
+
+    def manager(self, host=None):
+        """
+        :param host: Host name, the local daemon when None.
+        :type host: str
+        :rtype: DockerClientManager
+        """
+        manager = self.managers.get(host or LOCAL_HOST)
+        if manager is None:
+            raise ValueError(
+                f"Unknown Docker host {host}, known hosts: {', '.join(self.managers)}"
+            )
+        return manager
+
+    def fan_out(self, function, timeout=None):
+        """
+        Call ``function(host)`` for every host concurrently.
+
+        :param timeout: Seconds to wait for each host, the registry's by default.
+        :type timeout: float
+        :return: Result, or the exception raised, keyed by host name. A host
+            that did not answer in time gets a TimeoutError.
+        :rtype: dict
+        """
+        timeout = self.timeout if timeout is None else timeout
+        futures = {name: self._fan_out.submit(function, name) for name in self.managers}
+        # all hosts run at once, so one deadline covers every host
+        wait(futures.values(), timeout=timeout)
+        results = {}
+        for name, future in futures.items():
+            if not future.done():
+                future.cancel()
+                results[name] = TimeoutError(f"no answer after {timeout:.0f}s")
+            elif future.exception() is not None:
+                results[name] = future.exception()
+            else:
+                results[name] = future.result()
+        return results
+
+
+def is_local(host):
+    return host in (None, "", LOCAL_HOST)
+
+
+hosts = HostRegistry(
+    docker_client,
+    get_docker_hosts(),
+    cert_path=get_docker_cert_path(),
+    timeout=get_host_timeout(),
+)
+
+
+def get_client(host=None):
+    """
+    :param host: Host name, the local daemon when None.
+    :type host: str
+    :rtype: docker.DockerClient
+    """
+    return hosts.manager(host).get()
+
+
+def reconnect(idempotent=True):
+    """
+    Reset the client of the call's ``host`` when the daemon connection breaks.
+
+    :param idempotent: Retry the call once on a fresh connection.
+    :type idempotent: bool
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            try:
+                return function(*args, **kwargs)
+            except RequestsConnectionError as e:
+                logger.warning(f"Lost connection to Docker daemon: {e}")
+                hosts.manager(kwargs.get("host")).reset()
+                if not idempotent:
+                    raise
+            return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
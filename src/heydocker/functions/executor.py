@@ -0,0 +1,68 @@
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+from heydocker.config import get_tool_workers
+
+logger = logging.getLogger(__name__)
+
+
+class ToolExecutor:
+    """
+    Bounded thread pool for blocking work (Docker SDK, subprocess, SQLite).
+
+    Coroutines await ``run`` so the event loop keeps serving other chats while a
+    tool is executing.
+    """
+
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="heydocker-tool"
+        )
+
+    async def run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # run in a copy of the caller's context so tracing spans keep their parent
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._pool, partial(context.run, function, *args, **kwargs)
+        )
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+class ChatLocks:
+    """
+    One asyncio lock per chat so messages of the same chat are answered in the
+    order they were received, while different chats run concurrently.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._waiters = {}
+
+    @asynccontextmanager
+    async def hold(self, chat_id):
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = self._locks[chat_id] = asyncio.Lock()
+            self._waiters[chat_id] = 0
+        self._waiters[chat_id] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._waiters[chat_id] -= 1
+            if self._waiters[chat_id] == 0:
+                # nobody else is queued on this chat, forget the lock
+                del self._locks[chat_id]
+                del self._waiters[chat_id]
+
+
+tool_executor = ToolExecutor(max_workers=get_tool_workers())
+chat_locks = ChatLocks()
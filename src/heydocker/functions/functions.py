@@ -4,19 +4,30 @@ import os
 import re
 import subprocess
 
-import docker
-
-from heydocker.functions.utils import (convert_container_to_json,
+from heydocker.config import get_log_byte_cap
+from heydocker.functions.cache import tool_cache
+from heydocker.functions.docker_client import (get_client, hosts, is_local,
+                                               reconnect)
+from heydocker.functions.inventory import inventory
+from heydocker.functions.pulls import job_progress, pull_manager
+from heydocker.functions.stats import stats_sampler
+from heydocker.functions.utils import (LogSummary, convert_container_to_json,
                                        convert_image_to_json, convert_stats,
-                                       convert_volume_to_json)
+                                       convert_volume_to_json, format_byte,
+                                       format_host_results, format_stats,
+                                       format_stats_table, merge_host_results,
+                                       open_log_stream, parse_log_time)
 
 logger = logging.getLogger(__name__)
 
+MAX_LOG_TAIL = 10000
+
 # ==================== #
 #     Machine Info     #
 # ==================== #
 
 
+@tool_cache.cached(ttl=600)
 def check_network() -> str:
     """
     Check network speed, download speed and upload speed.
@@ -31,6 +42,7 @@ def check_network() -> str:
         return "Network speed test failed."
 
 
+@tool_cache.cached(ttl=300)
 def check_ip() -> str:
     """
     Check IP address.
@@ -42,6 +54,7 @@ def check_ip() -> str:
     return f"IP Address: {ip_address}"
 
 
+@tool_cache.cached(ttl=30, tags=("containers", "images", "volumes"))
 def check_disk_usage() -> str:
     """
     Check disk usage.
@@ -58,15 +71,23 @@ def check_disk_usage() -> str:
 # ==================== #
 
 
-def list_images() -> str:
+@tool_cache.cached(ttl=10, tags=("images",))
+@reconnect()
+def list_images(host: str = None) -> str:
     """
     List all docker images.
 
+    :param host: Docker host name, the local one if not given.
+    :type host: str
+
     :return: Docker images.
     :rtype: str
     """
-    client = client = docker.from_env()
-    images = client.images.list()
+    client = get_client(host)
+    if is_local(host) and inventory.ready:
+        images = [client.images.prepare_model(x) for x in inventory.list("images")]
+    else:
+        images = client.images.list()
 
     json_message = {"docker_images": [convert_image_to_json(image) for image in images]}
     response = json.dumps(json_message)
@@ -74,36 +95,50 @@ def list_images() -> str:
     return response
 
 
-def get_image(image_name: str) -> str:
+@tool_cache.cached(ttl=10, tags=("images",))
+@reconnect()
+def get_image(image_name: str, host: str = None) -> str:
     """
     Get raw data of docker image by name.
 
     :param image_name: Docker image name.
     :type image_name: str
+    :param host: Docker host name, the local one if not given.
+    :type host: str
 
     :return: Docker image.
     :rtype: str
     """
-    client = client = docker.from_env()
-    image = client.images.get(image_name)
+    attrs = None
+    if is_local(host) and inventory.ready:
+        attrs = inventory.get("images", image_name)
+    if attrs is None:
+        client = get_client(host)
+        image = client.images.get(image_name)
 
-    if image == None:
-        return f"Docker image {image_name} not found."
+        if image == None:
+            return f"Docker image {image_name} not found."
 
-    json_message = {"docker_image": image.attrs}
+        attrs = image.attrs
+
+    json_message = {"docker_image": attrs}
     response = json.dumps(json_message)
 
     return response
 
 
-def remove_image(image_name: str) -> str:
+@tool_cache.invalidates("images")
+@reconnect(idempotent=False)
+def remove_image(image_name: str, host: str = None) -> str:
     """
     Remove docker image by name.
 
     :param image_name: Docker image name.
     :type image_name: str
+    :param host: Docker host name, the local one if not given.
+    :type host: str
     """
-    client = client = docker.from_env()
+    client = get_client(host)
     image = client.images.get(image_name)
 
     if image == None:
@@ -113,35 +148,86 @@ def remove_image(image_name: str) -> str:
     return f"Docker image {image_name} has been removed."
 
 
-def pull_image(repository: str, tag: str) -> str:
+def pull_image(repository: str, tag: str, host: str = None) -> str:
     """
-    Pull docker image by repository and tag.
+    Pull docker image by repository and tag in the background.
 
     :param repository: Docker image repository.
     :type repository: str
     :param tag: Docker image tag.
     :type tag: str
+    :param host: Docker host name, the local one if not given.
+    :type host: str
 
-    :return: Docker image pull result.
+    :return: Id of the pull job.
     :rtype: str
     """
-    client = client = docker.from_env()
-    image = client.images.pull(repository, tag)
+    # an unknown or unreachable host fails now rather than in the background
+    get_client(host)
+    # the user who asked sees the layers progress in a message of its own
+    progress = job_progress.get()
+    job, created = pull_manager.start(
+        repository, tag, host, listener=progress() if progress is not None else None
+    )
 
-    if image == None:
-        return f"Docker image {repository}:{tag} not found."
+    if not created:
+        return f"Docker image {job.ref} is already being pulled as job {job.id}."
+    return (
+        f"Pulling docker image {job.ref} in the background as job {job.id}, "
+        "the progress is shown in a separate message."
+    )
+
+
+def pull_status(job_id: str = None) -> str:
+    """
+    Get the progress of docker image pull jobs.
+
+    :param job_id: Pull job id, all recent jobs if not given.
+    :type job_id: str
 
-    return f"Docker image {repository}:{tag} has been pulled."
+    :return: Pull job progress.
+    :rtype: str
+    """
+    if job_id:
+        job = pull_manager.get(job_id)
+        if job is None:
+            return f"Pull job {job_id} not found."
+        return job.progress()
+
+    jobs = pull_manager.list()
+    if not jobs:
+        return "No image pulls."
+    return "\n\n".join(job.progress() for job in jobs)
+
+
+def cancel_pull(job_id: str) -> str:
+    """
+    Cancel a docker image pull job.
 
+    :param job_id: Pull job id.
+    :type job_id: str
 
-def prune_images() -> str:
+    :return: Pull job cancel result.
+    :rtype: str
+    """
+    if not pull_manager.cancel(job_id):
+        return f"Pull job {job_id} is not running."
+    return f"Pull job {job_id} is being cancelled."
+
+
+@tool_cache.invalidates("images")
+@reconnect()
+def prune_images(host: str = None) -> str:
     """
     Delete all unused docker images.
 
+    :param host: Docker host name, the local one if not given.
+    :type host: str
+
     :return: Docker images prune result.
     :rtype: str
     """
-    client = client = docker.from_env()
+    client = get_client(host)
     images = client.images.prune()
 
     response = json.dumps(images)
@@ -154,15 +240,25 @@ def prune_images() -> str:
 # ==================== #
 
 
-def list_containers() -> str:
+@tool_cache.cached(ttl=5, tags=("containers",))
+@reconnect()
+def list_containers(host: str = None) -> str:
     """
     List all docker containers.
 
+    :param host: Docker host name, the local one if not given.
+    :type host: str
+
     :return: Docker containers.
     :rtype: str
     """
-    client = client = docker.from_env()
-    containers = client.containers.list(all=True)
+    client = get_client(host)
+    if is_local(host) and inventory.ready:
+        containers = [
+            client.containers.prepare_model(x) for x in inventory.list("containers")
+        ]
+    else:
+        containers = client.containers.list(all=True)
 
     json_message = {
         "docker_containers": [
@@ -174,37 +270,51 @@ def list_containers() -> str:
     return response
 
 
-def get_container(container_name: str) -> str:
+@tool_cache.cached(ttl=5, tags=("containers",))
+@reconnect()
+def get_container(container_name: str, host: str = None) -> str:
     """
     Get raw data of docker container by name.
 
     :param container_name: Docker container name.
     :type container_name: str
+    :param host: Docker host name, the local one if not given.
+    :type host: str
     :return: Docker container.
     :rtype: str
     """
-    client = client = docker.from_env()
-    container = client.containers.get(container_name)
+    attrs = None
+    if is_local(host) and inventory.ready:
+        attrs = inventory.get("containers", container_name)
+    if attrs is None:
+        client = get_client(host)
+        container = client.containers.get(container_name)
 
-    if container == None:
-        return f"Docker container {container_name} not found."
+        if container == None:
+            return f"Docker container {container_name} not found."
 
-    json_message = {"docker_container": container.attrs}
+        attrs = container.attrs
+
+    json_message = {"docker_container": attrs}
     response = json.dumps(json_message)
 
     return response
 
 
-def run_container(image_name: str) -> str:
+@tool_cache.invalidates("containers")
+@reconnect(idempotent=False)
+def run_container(image_name: str, host: str = None) -> str:
     """
     Run docker container by image name.
 
     :param image_name: Docker image name.
     :type image_name: str
+    :param host: Docker host name, the local one if not given.
+    :type host: str
     :return: Docker container run result.
     :rtype: str
     """
-    client = client = docker.from_env()
+    client = get_client(host)
     image = client.images.get(image_name)
 
     if image == None:
@@ -214,17 +324,21 @@ def run_container(image_name: str) -> str:
     return f"Image {image_name} has been run as container {container.name}."
 
 
-def create_container(image_name: str) -> str:
+@tool_cache.invalidates("containers")
+@reconnect(idempotent=False)
+def create_container(image_name: str, host: str = None) -> str:
     """
     Create docker container by image name.
 
     :param image_name: Docker image name.
     :type image_name: str
+    :param host: Docker host name, the local one if not given.
+    :type host: str
 
     :return: Docker container create result.
     :rtype: str
     """
-    client = client = docker.from_env()
+    client = get_client(host)
     image = client.images.get(image_name)
 
     if image == None:
@@ -234,16 +348,20 @@ def create_container(image_name: str) -> str:
     return f"Image {image_name} has been created as container {container.name}."
 
 
-def start_container(container_name: str) -> str:
+@tool_cache.invalidates("containers")
+@reconnect()
+def start_container(container_name: str, host: str = None) -> str:
     """
     Start docker container by container name.
 
     :param container_name: Docker container name.
     :type container_name: str
+    :param host: Docker host name, the local one if not given.
+    :type host: str
     :return: Docker container start result.
     :rtype: str
     """
-    client = client = docker.from_env()
+    client = get_client(host)
     container = client.containers.get(container_name)
 
     if container == None:
@@ -253,16 +371,20 @@ def start_container(container_name: str) -> str:
     return f"Container {container_name} has been started."
 
 
-def restart_container(container_name: str) -> str:
+@tool_cache.invalidates("containers")
+@reconnect(idempotent=False)
+def restart_container(container_name: str, host: str = None) -> str:
     """
     Restart docker container by container name.
 
     :param container_name: Docker container name.
     :type container_name: str
+    :param host: Docker host name, the local one if not given.
+    :type host: str
     :return: Docker container restart result.
     :rtype: str
     """
-    client = client = docker.from_env()
+    client = get_client(host)
     container = client.containers.get(container_name)
 
     if container == None:
@@ -272,16 +394,20 @@ def restart_container(container_name: str) -> str:
     return f"Cotainer {container_name} has been restarted."
 
 
-def remove_container(container_name: str) -> str:
+@tool_cache.invalidates("containers")
+@reconnect(idempotent=False)
+def remove_container(container_name: str, host: str = None) -> str:
     """
     Remove docker container by container name.
 
     :param container_name: Docker container name.
     :type container_name: str
+    :param host: Docker host name, the local one if not given.
+    :type host: str
     :return: Docker container remove result.
     :rtype: str
     """
-    client = client = docker.from_env()
+    client = get_client(host)
     container = client.containers.get(container_name)
 
     if container == None:
@@ -291,16 +417,20 @@ def remove_container(container_name: str) -> str:
     return f"Container {container_name} has been removed."
 
 
-def stop_container(container_name: str) -> str:
+@tool_cache.invalidates("containers")
+@reconnect()
+def stop_container(container_name: str, host: str = None) -> str:
     """
     Stop docker container by container name.
 
     :param container_name: Docker container name.
     :type container_name: str
+    :param host: Docker host name, the local one if not given.
+    :type host: str
     :return: Docker container stop result.
     :rtype: str
     """
-    client = client = docker.from_env()
+    client = get_client(host)
     container = client.containers.get(container_name)
 
     if container == None:
@@ -310,17 +440,25 @@ def stop_container(container_name: str) -> str:
     return f"Container {container_name} has been stopped."
 
 
-def stats_container(container_name: str) -> str:
+@reconnect()
+def stats_container(container_name: str, host: str = None) -> str:
     """
     Get docker container stats by container name.
 
     :param container_name: Docker container name.
     :type container_name: str
+    :param host: Docker host name, the local one if not given.
+    :type host: str
 
     :return: Docker container stats.
     :rtype: str
     """
-    client = client = docker.from_env()
+    # answer from the background sampler when it has a recent sample
+    sample = stats_sampler.latest(container_name) if is_local(host) else None
+    if sample is not None:
+        return f"Container stats: {format_stats(sample)}"
+
+    client = get_client(host)
     container = client.containers.get(container_name)
 
     if container == None:
@@ -334,14 +472,139 @@ def stats_container(container_name: str) -> str:
     return f"Container stats: {message}"
 
 
-def prune_containers() -> str:
+@reconnect()
+def container_logs(
+    container_name: str,
+    tail: int = 100,
+    since: str = None,
+    until: str = None,
+    grep: str = None,
+    host: str = None,
+) -> str:
+    """
+    Get the logs of a docker container, repeated lines are counted once.
+
+    :param container_name: Docker container name.
+    :type container_name: str
+    :param tail: Number of lines from the end of the logs, at most 10000.
+    :type tail: int
+    :param since: Only logs after this time, e.g. "15m", "2h", "1d" or an ISO 8601 time.
+    :type since: str
+    :param until: Only logs before this time, same format as since.
+    :type until: str
+    :param grep: Only lines matching this regular expression, case insensitive.
+    :type grep: str
+    :param host: Docker host name, the local one if not given.
+    :type host: str
+
+    :return: Docker container logs summary.
+    :rtype: str
+    """
+    pattern = None
+    if grep:
+        try:
+            pattern = re.compile(grep, re.IGNORECASE)
+        except re.error:
+            pattern = re.compile(re.escape(grep), re.IGNORECASE)
+
+    client = get_client(host)
+    stream = open_log_stream(
+        client,
+        container_name,
+        tail=max(1, min(tail, MAX_LOG_TAIL)),
+        since=parse_log_time(since) if since else None,
+        until=parse_log_time(until) if until else None,
+    )
+
+    # read chunk by chunk and hang up at the byte cap instead of loading it all
+    summary = LogSummary(pattern, max_bytes=get_log_byte_cap())
+    try:
+        for chunk in stream:
+            if not summary.feed(chunk):
+                break
+    finally:
+        stream.close()
+    summary.close()
+
+    return f"Container logs: {summary.format()}"
+
+
+@reconnect()
+def stats_all_containers(host: str = None) -> str:
+    """
+    Get stats of all running docker containers at once.
+
+    :param host: Docker host name, the local one if not given.
+    :type host: str
+
+    :return: Docker containers stats sorted by CPU usage.
+    :rtype: str
+    """
+    client = get_client(host)
+    containers = client.api.containers(filters={"status": "running"})
+
+    if not containers:
+        return "No running containers."
+
+    names = {container["Id"]: container["Names"][0].lstrip("/") for container in containers}
+    # only the local daemon is sampled in the background
+    stats = stats_sampler.snapshot(names, None if is_local(host) else client)
+
+    return f"Containers stats:\n{format_stats_table(stats)}"
+
+
+def top_containers(metric: str, limit: int = 5) -> str:
+    """
+    List the containers using the most CPU or memory over the last 5 minutes.
+
+    :param metric: Either "cpu" or "memory".
+    :type metric: str
+    :param limit: Number of containers to list.
+    :type limit: int
+
+    :return: Containers with their average and maximum usage.
+    :rtype: str
+    """
+    if not stats_sampler.running:
+        return "Container stats sampling is disabled."
+
+    if metric == "cpu":
+        rows = stats_sampler.top("cpu_percentage", limit=limit)
+        formatter = "{:.2f}%".format
+    elif metric == "memory":
+        rows = stats_sampler.top("mem_usage", limit=limit)
+        formatter = lambda x: format_byte(int(x))
+    else:
+        return f"Unknown metric {metric}, use cpu or memory."
+
+    json_message = {
+        "top_containers": [
+            {
+                "name": row["name"],
+                f"average_{metric}": formatter(row["average"]),
+                f"maximum_{metric}": formatter(row["maximum"]),
+            }
+            for row in rows
+        ]
+    }
+    response = json.dumps(json_message)
+
+    return response
+
+
+@tool_cache.invalidates("containers")
+@reconnect()
+def prune_containers(host: str = None) -> str:
     """
     Delete all stopped docker containers.
 
+    :param host: Docker host name, the local one if not given.
+    :type host: str
+
     :return: Docker containers prune result.
     :rtype: str
     """
-    client = client = docker.from_env()
+    client = get_client(host)
     containers = client.containers.prune()
 
     response = json.dumps(containers)
@@ -354,15 +617,23 @@ def prune_containers() -> str:
 # ==================== #
 
 
-def list_volumes() -> str:
+@tool_cache.cached(ttl=10, tags=("volumes",))
+@reconnect()
+def list_volumes(host: str = None) -> str:
     """
     List all docker volumes.
 
+    :param host: Docker host name, the local one if not given.
+    :type host: str
+
     :return: Docker volumes.
     :rtype: str
     """
-    client = client = docker.from_env()
-    volumes = client.volumes.list()
+    client = get_client(host)
+    if is_local(host) and inventory.ready:
+        volumes = [client.volumes.prepare_model(x) for x in inventory.list("volumes")]
+    else:
+        volumes = client.volumes.list()
 
     json_message = {
         "docker_volumes": [convert_volume_to_json(volume) for volume in volumes]
@@ -372,52 +643,71 @@ def list_volumes() -> str:
     return response
 
 
-def get_volume(volume_name: str) -> str:
+@tool_cache.cached(ttl=10, tags=("volumes",))
+@reconnect()
+def get_volume(volume_name: str, host: str = None) -> str:
     """
     Get raw data of docker volume by name.
 
     :param volume_name: Docker volume name.
     :type volume_name: str
+    :param host: Docker host name, the local one if not given.
+    :type host: str
 
     :return: Docker volume.
     :rtype: str
     """
-    client = client = docker.from_env()
-    volume = client.volumes.get(volume_name)
+    attrs = None
+    if is_local(host) and inventory.ready:
+        attrs = inventory.get("volumes", volume_name)
+    if attrs is None:
+        client = get_client(host)
+        volume = client.volumes.get(volume_name)
 
-    if volume == None:
-        return f"Docker volume {volume_name} not found."
+        if volume == None:
+            return f"Docker volume {volume_name} not found."
 
-    json_message = {"docker_volume": volume.attrs}
+        attrs = volume.attrs
+
+    json_message = {"docker_volume": attrs}
     response = json.dumps(json_message)
 
     return response
 
 
-def create_volume():
+@tool_cache.invalidates("volumes")
+@reconnect(idempotent=False)
+def create_volume(host: str = None) -> str:
     """
     Create docker volume.
 
+    :param host: Docker host name, the local one if not given.
+    :type host: str
+
     :return: Docker volume create result.
     :rtype: str
     """
-    client = client = docker.from_env()
+    client = get_client(host)
     volume = client.volumes.create()
 
     return f"Volume {volume.name} has been created."
 
 
-def remove_volume(volume_name: str) -> str:
+@tool_cache.invalidates("volumes")
+@reconnect(idempotent=False)
+def remove_volume(volume_name: str, host: str = None) -> str:
     """
     Remove docker volume by volume name.
 
     :param volume_name: Docker volume name.
     :type volume_name: str
+    :param host: Docker host name, the local one if not given.
+    :type host: str
 
     :return: Docker volume remove result.
     :rtype: str
     """
-    client = client = docker.from_env()
+    client = get_client(host)
     volume = client.volumes.get(volume_name)
 
     if volume == None:
@@ -427,16 +717,58 @@ def remove_volume(volume_name: str) -> str:
     return f"Volume {volume_name} has been removed."
 
 
-def prune_volume() -> str:
+@tool_cache.invalidates("volumes")
+@reconnect()
+def prune_volume(host: str = None) -> str:
     """
     Delete all unused docker volumes.
 
+    :param host: Docker host name, the local one if not given.
+    :type host: str
+
     :return: Docker volumes prune result.
     :rtype: str
     """
-    client = client = docker.from_env()
+    client = get_client(host)
     volumes = client.volumes.prune()
 
     response = json.dumps(volumes)
 
     return f"Prune Docker volumes: {response}"
+
+
+# ==================== #
+#     Docker Fleet     #
+# ==================== #
+
+
+def list_hosts() -> str:
+    """
+    List the Docker hosts that can be monitored and controlled.
+
+    :return: Docker host names.
+    :rtype: str
+    """
+    return json.dumps({"docker_hosts": hosts.names()})
+
+
+def list_fleet_containers() -> str:
+    """
+    List all docker containers of every Docker host at once.
+
+    :return: Docker containers by host, and the hosts that failed to answer.
+    :rtype: str
+    """
+    results = hosts.fan_out(lambda host: list_containers(host=host))
+    return merge_host_results("docker_containers", results)
+
+
+def stats_fleet_containers() -> str:
+    """
+    Get stats of all running docker containers of every Docker host at once.
+
+    :return: Docker containers stats by host.
+    :rtype: str
+    """
+    results = hosts.fan_out(lambda host: stats_all_containers(host=host))
+    return format_host_results(results)
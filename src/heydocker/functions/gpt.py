@@ -1,63 +1,32 @@
-import inspect
+import asyncio
+import json
 import logging
-import os
 
-import openai
-from docstring_parser import parse
-
-from heydocker.config import get_openai_api_key
+from heydocker.config import (get_cache_dir, get_conversation_idle_timeout,
+                              get_history_size, get_max_conversations,
+                              get_llm_backend, get_llm_retries,
+                              get_llm_timeout, get_max_tool_rounds,
+                              get_openai_api_base, get_openai_model,
+                              get_prompt_budget,
+                              get_router_enabled, get_router_threshold,
+                              get_tool_output_budget)
 from heydocker.functions import functions
+from heydocker.functions.conversation import ConversationStore
+from heydocker.functions.docker_client import hosts, is_local
+from heydocker.functions.executor import tool_executor
+from heydocker.functions.llm import create_backend
+from heydocker.functions.prompt import PromptBuilder
+from heydocker.functions.registry import ToolRegistry
+from heydocker.functions.router import IntentRouter
+from heydocker.metrics import metrics
+from heydocker.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
 
-def generate_gpt_functions(available_functions):
-    """get all functions from functions.py"""
-    python_obj_to_json_obj = {
-        "str": "string",
-        "int": "integer",
-        "float": "number",
-        "bool": "boolean",
-        "list": "array",
-        "dict": "object",
-    }
-
-    gpt_functions = []
-
-    for function in available_functions:
-        name = function.__name__
-        docstring = inspect.getdoc(function)
-        docstring_obj = parse(docstring)
-        description = docstring_obj.short_description
-
-        properties = {}
-        for param in docstring_obj.params:
-            param_name = param.arg_name
-            param_type = param.type_name
-            param_description = param.description
-
-            properties[param_name] = {
-                "type": python_obj_to_json_obj[param_type],
-                "description": param_description,
-            }
-
-        gpt_functions.append(
-            {
-                "name": name,
-                "description": description,
-                "parameters": {"type": "object", "properties": properties},
-            }
-        )
-
-    return gpt_functions
-
-
-available_functions = [
-    func
-    for func in functions.__dict__.values()
-    if callable(func) and func.__module__ == functions.__name__
-]
-gpt_functions = generate_gpt_functions(available_functions)
+tool_registry = ToolRegistry(functions, cache_dir=get_cache_dir())
+gpt_functions = tool_registry.schemas
+gpt_tools = [{"type": "function", "function": schema} for schema in gpt_functions]
 
 
 class GPTClient:
@@ -66,87 +35,238 @@ class GPTClient:
             "role": "system",
             "content": "You are a helpful assistant on a chat app. You can help user to monitor, remote, and control their docker server. Don't make assumptions about what values to use with functions. Ask for clarification if a user request is ambiguous. Always answer with human-readable text.",
         }
-        self.history = []
+        self.conversations = ConversationStore(
+            max_messages=get_history_size(),
+            max_conversations=get_max_conversations(),
+            idle_timeout=get_conversation_idle_timeout(),
+        )
+        self.model = get_openai_model()
+        self.backend = create_backend(
+            get_llm_backend(),
+            self.model,
+            api_base=get_openai_api_base(),
+            timeout=get_llm_timeout(),
+            retries=get_llm_retries(),
+        )
+        self.max_tool_rounds = get_max_tool_rounds()
+        self.prompt_builder = PromptBuilder(
+            self.model,
+            tool_output_budget=get_tool_output_budget(),
+            prompt_budget=get_prompt_budget(),
+        )
+        self.router = None
+        if get_router_enabled():
+            self.router = IntentRouter(
+                threshold=get_router_threshold(),
+                hosts=[host for host in hosts.names() if not is_local(host)],
+            )
 
-    @property
-    def messages(self):
-        return [self.header] + self.history[-4:]
+    def messages(self, chat_id):
+        return [self.header] + self.conversations.messages(chat_id)
 
-    def add_message(self, message):
-        self.history.append(message)
+    def add_message(self, chat_id, message):
+        self.conversations.add_message(chat_id, message)
 
-    def handle_command(self, command):
-        openai.api_key = get_openai_api_key()
+    async def call_tool(self, tool_call):
+        function_name = tool_call["function"]["name"]
+        function_args = tool_call["function"]["arguments"]
+        with tracer.span(f"tool.{function_name}", tool=function_name) as span:
+            try:
+                logger.info(f"Execute Function: {function_name}({function_args})")
+                # blocking Docker/subprocess calls run on the tool thread pool
+                function_response = await tool_executor.run(
+                    tool_registry.call, function_name, function_args
+                )
+            except Exception as e:
+                span.error = f"{type(e).__name__}: {e}"
+                function_response = f"ERROR {e}"
 
-        self.add_message(
-            {
-                "role": "user",
-                "content": command,
-            }
+        logger.info(f"Function Response: {function_response}")
+        return str(function_response)
+
+    async def complete(self, messages, tool_choice, on_update=None):
+        """
+        Get the next assistant message.
+
+        With ``on_update`` the completion is streamed and the callback is awaited
+        with the text received so far every time it grows.
+
+        :return: Assistant message with its content and tool calls.
+        :rtype: dict
+        """
+        with tracer.span(
+            "llm.complete", model=self.model, stream=on_update is not None
+        ) as span:
+            message = await self._complete(messages, tool_choice, on_update)
+            counter = self.prompt_builder.counter
+            prompt_tokens = counter.count_messages(messages)
+            completion_tokens = counter.count_messages([message])
+            tool_calls = message.get("tool_calls") or []
+            span.set(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                tool_calls=len(tool_calls),
+            )
+        metrics.inc("heydocker_llm_requests_total", model=self.model)
+        metrics.inc("heydocker_llm_tokens_total", prompt_tokens, model=self.model, type="prompt")
+        metrics.inc(
+            "heydocker_llm_tokens_total", completion_tokens, model=self.model, type="completion"
         )
+        return message
+
+    async def _complete(self, messages, tool_choice, on_update):
+        if on_update is None:
+            return await self.backend.complete(messages, gpt_tools, tool_choice)
 
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo-0613",
-            messages=self.messages,
-            functions=gpt_functions,
-            function_call="auto",
+        content = ""
+        tool_calls = {}
+        stream = await self.backend.complete(
+            messages, gpt_tools, tool_choice, stream=True
         )
+        async for chunk in stream:
+            if not chunk["choices"]:
+                continue
+            delta = chunk["choices"][0].get("delta") or {}
+            if delta.get("content"):
+                content += delta["content"]
+                await on_update(content)
+            # tool calls arrive in fragments, joined by their index
+            for fragment in delta.get("tool_calls") or []:
+                tool_call = tool_calls.setdefault(
+                    fragment["index"],
+                    {"id": "", "function": {"name": "", "arguments": ""}},
+                )
+                tool_call["id"] += fragment.get("id") or ""
+                function = fragment.get("function") or {}
+                tool_call["function"]["name"] += function.get("name") or ""
+                tool_call["function"]["arguments"] += function.get("arguments") or ""
 
-        response_message = response["choices"][0]["message"]
+        return {
+            "role": "assistant",
+            "content": content or None,
+            "tool_calls": [tool_calls[index] for index in sorted(tool_calls)],
+        }
+
+    async def answer_locally(self, command, chat_id):
+        """
+        Answer common read-only commands with a tool and a template, no model.
 
-        if response_message.get("function_call"):
-            function_name = response_message["function_call"]["name"]
-            function_args = response_message["function_call"]["arguments"]
+        :return: Answer, or None when the model has to answer.
+        :rtype: str
+        """
+        with tracer.span("router") as span:
+            routed = self.router.route(command)
+            if routed is None:
+                return None
 
-            command = f"functions.{function_name}(**{function_args})"
+            intent, kwargs = routed
+            span.set(tool=intent.tool)
             try:
-                logger.info(f"Execute Function: {command}")
-                function_response = eval(command)
+                function_response = await tool_executor.run(
+                    tool_registry.call, intent.tool, json.dumps(kwargs)
+                )
+                response = intent.template(function_response)
             except Exception as e:
-                function_response = f"ERROR {e}"
+                span.error = f"{type(e).__name__}: {e}"
+                logger.warning(f"Local answer with {intent.tool} failed: {e}")
+                return None
 
-            logger.info(f"Function Response: {function_response}")
+        logger.info(f"Answered locally with {intent.tool}")
+        self.add_message(chat_id, {"role": "user", "content": command})
+        self.add_message(chat_id, {"role": "assistant", "content": response})
+        return response
 
-            # Add the assistant response and function response to the messages
-            self.add_message(
-                {
-                    "role": response_message["role"],
-                    "function_call": {
-                        "name": function_name,
-                        "arguments": response_message["function_call"]["arguments"],
-                    },
-                    "content": None,
-                }
-            )
+    async def handle_command(self, command, chat_id=None, on_update=None):
+        with tracer.span("handle_command", chat_id=chat_id):
+            return await self._handle_command(command, chat_id, on_update)
 
-            self.add_message(
-                {
-                    "role": "function",
-                    "name": function_name,
-                    "content": function_response,
-                }
-            )
+    async def _handle_command(self, command, chat_id, on_update):
+        await self.conversations.restore(chat_id)
+        if self.router is not None:
+            response = await self.answer_locally(command, chat_id)
+            if response is not None:
+                return response
 
-            # Call the API again to get the final response from the model
-            second_response = openai.ChatCompletion.create(
-                messages=self.messages, model="gpt-3.5-turbo-0613"
-            )
+        # messages of this turn are kept aside so a turn with many tool calls is
+        # never cut by the conversation ring buffer while it is running
+        messages = self.messages(chat_id)
+        turn = []
+        tokens_saved = 0
 
-            self.add_message(
-                {
-                    "role": second_response["choices"][0]["message"]["role"],
-                    "content": second_response["choices"][0]["message"]["content"],
-                }
+        def add_message(message):
+            turn.append(message)
+            self.add_message(chat_id, message)
+
+        add_message(
+            {
+                "role": "user",
+                "content": command,
+            }
+        )
+
+        for tool_round in range(self.max_tool_rounds + 1):
+            with tracer.span("prompt.fit", round=tool_round):
+                prompt, dropped = self.prompt_builder.fit(messages, turn)
+            tokens_saved += dropped
+
+            # after max_tool_rounds the model has to answer with what it has
+            last_round = tool_round == self.max_tool_rounds
+            response_message = await self.complete(
+                prompt, "none" if last_round else "auto", on_update
             )
+            tool_calls = response_message.get("tool_calls")
 
-            return second_response["choices"][0]["message"]["content"]
+            if not tool_calls or last_round:
+                add_message(
+                    {
+                        "role": response_message["role"],
+                        "content": response_message["content"],
+                    }
+                )
+                prompt_tokens = self.prompt_builder.counter.count_messages(prompt)
+                logger.info(
+                    f"Prompt tokens: {prompt_tokens}, saved by compaction: {tokens_saved}"
+                )
+                return response_message["content"]
 
-        else:
-            self.add_message(
+            # Add the assistant response, run all requested tools concurrently and
+            # add their responses to the messages
+            add_message(
                 {
                     "role": response_message["role"],
-                    "content": response_message["content"],
+                    "content": response_message.get("content"),
+                    "tool_calls": [
+                        {
+                            "id": tool_call["id"],
+                            "type": "function",
+                            "function": {
+                                "name": tool_call["function"]["name"],
+                                "arguments": tool_call["function"]["arguments"],
+                            },
+                        }
+                        for tool_call in tool_calls
+                    ],
                 }
             )
 
-            return response_message["content"]
+            if on_update is not None:
+                names = ", ".join(x["function"]["name"] for x in tool_calls)
+                await on_update(f"Running {names}…")
+
+            function_responses = await asyncio.gather(
+                *[self.call_tool(tool_call) for tool_call in tool_calls]
+            )
+
+            for tool_call, function_response in zip(tool_calls, function_responses):
+                # oversized outputs are compacted before they enter the prompt
+                function_response, saved = self.prompt_builder.compact_tool_output(
+                    function_response
+                )
+                tokens_saved += saved
+                add_message(
+                    {
+                        "role": "tool",
+                        "tool_call_id": tool_call["id"],
+                        "content": function_response,
+                    }
+                )
@@ -0,0 +1,205 @@
+import logging
+import threading
+import time
+
+from docker.errors import NotFound
+
+from heydocker.functions.docker_client import DockerClientManager
+
+logger = logging.getLogger(__name__)
+
+# events that do not change what the inventory shows
+IGNORED_ACTIONS = ("exec_", "attach", "detach", "resize", "top", "copy", "archive-path")
+
+INSPECT = {
+    "containers": "inspect_container",
+    "images": "inspect_image",
+    "volumes": "inspect_volume",
+}
+
+
+class Inventory:
+    """
+    In-process cache of the Docker containers, images and volumes.
+
+    The cache is loaded once and then kept current from the Docker ``events``
+    stream: each event re-inspects or drops the single object it is about, so
+    listing is a memory read instead of one inspect call per object. While the
+    cache is not synced (not started, or reconnecting after the daemon went
+    away) ``ready`` is False and callers should ask the API directly.
+    """
+
+    def __init__(self, retry_interval=5):
+        self.retry_interval = retry_interval
+        self.containers = {}
+        self.images = {}
+        self.volumes = {}
+        self.ready = False
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._client = DockerClientManager(pool_size=2)
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="heydocker-inventory", daemon=True
+            )
+            self._thread.start()
+
+    def subscribe(self, callback):
+        """
+        Call ``callback(event)`` for every Docker event once the cache is updated.
+
+        :param callback: Function receiving the decoded event.
+        :type callback: callable
+        """
+        self._listeners.append(callback)
+
+    def _run(self):
+        while True:
+            try:
+                since = int(time.time())
+                self.sync()
+                # replay events that happened while syncing, then follow the stream
+                for event in self._client.get().api.events(since=since, decode=True):
+                    self.handle(event)
+            except Exception as e:
+                logger.warning(f"Docker events stream failed: {e}")
+            self.ready = False
+            self._client.reset()
+            time.sleep(self.retry_interval)
+
+    def sync(self):
+        """Load every container, image and volume."""
+        api = self._client.get().api
+        containers = {}
+        for container in api.containers(all=True):
+            try:
+                containers[container["Id"]] = api.inspect_container(container["Id"])
+            except NotFound:
+                pass
+        images = {}
+        for image in api.images():
+            try:
+                images[image["Id"]] = api.inspect_image(image["Id"])
+            except NotFound:
+                pass
+        volumes = {
+            volume["Name"]: volume for volume in api.volumes().get("Volumes") or []
+        }
+        with self._lock:
+            self.containers = containers
+            self.images = images
+            self.volumes = volumes
+        self.ready = True
+        logger.info(
+            f"Inventory synced: {len(containers)} containers, {len(images)} images, {len(volumes)} volumes"
+        )
+
+    def handle(self, event):
+        event_type = event.get("Type")
+        action = event.get("Action", "")
+        object_id = event.get("Actor", {}).get("ID")
+        if not object_id or action.startswith(IGNORED_ACTIONS):
+            return
+
+        if event_type == "container":
+            self._update("containers", object_id, action == "destroy")
+        elif event_type == "image":
+            self._update("images", object_id, action == "delete")
+        elif event_type == "volume" and action in ("create", "destroy"):
+            self._update("volumes", object_id, action == "destroy")
+        else:
+            return
+
+        for callback in self._listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"Inventory listener failed: {e}")
+
+    def _update(self, kind, object_id, removed):
+        inspect = getattr(self._client.get().api, INSPECT[kind])
+        attrs = None
+        if not removed:
+            try:
+                attrs = inspect(object_id)
+            except NotFound:
+                pass
+
+        key = "Name" if kind == "volumes" else "Id"
+        with self._lock:
+            objects = getattr(self, kind)
+            if attrs is not None:
+                objects[attrs[key]] = attrs
+            else:
+                # gone, the event may name it by id, name or tag
+                gone = self._find(kind, objects, object_id)
+                if gone is not None:
+                    del objects[gone[key]]
+
+    @staticmethod
+    def _is_named(kind, attrs, name):
+        if kind == "containers":
+            return attrs["Name"].lstrip("/") == name
+        if kind == "images":
+            tag = name
+            if ":" not in name.split("/")[-1]:
+                tag += ":latest"
+            return tag in (attrs.get("RepoTags") or [])
+        return attrs["Name"] == name
+
+    @classmethod
+    def _find(cls, kind, objects, name):
+        """
+        Resolve a name like the daemon does: full id, then exact name or tag,
+        then an id prefix matching a single object.
+        """
+        if not name:
+            return None
+        if kind != "volumes":
+            short_id = name.split(":")[-1] if name.startswith("sha256:") else name
+            for attrs in objects.values():
+                if attrs["Id"].split(":")[-1] == short_id:
+                    return attrs
+        for attrs in objects.values():
+            if cls._is_named(kind, attrs, name):
+                return attrs
+        if kind == "volumes":
+            return None
+        found = [
+            attrs for attrs in objects.values()
+            if attrs["Id"].split(":")[-1].startswith(short_id)
+        ]
+        # an ambiguous prefix is left to the daemon, which reports it
+        return found[0] if len(found) == 1 else None
+
+    def list(self, kind):
+        """
+        Get the cached attrs of every container, image or volume.
+
+        :param kind: "containers", "images" or "volumes".
+        :type kind: str
+        :rtype: list
+        """
+        with self._lock:
+            return list(getattr(self, kind).values())
+
+    def get(self, kind, name):
+        """
+        Get the cached attrs of one object by id, name, tag or unique id prefix.
+
+        :return: Attrs, or None if there is no such object or the id prefix is
+            ambiguous.
+        :rtype: dict
+        """
+        with self._lock:
+            return self._find(kind, getattr(self, kind), name)
+
+
+inventory = Inventory()
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import random
+
+import httpx
+import openai
+
+from heydocker.config import get_openai_api_key
+
+logger = logging.getLogger(__name__)
+
+
+async def with_retries(call, retries, base_delay, retryable):
+    """
+    Await ``call()``, retrying with full-jitter exponential backoff.
+
+    :param retries: Retries after the first attempt.
+    :type retries: int
+    :param base_delay: Delay before the first retry, doubled for each retry.
+    :type base_delay: float
+    :param retryable: Exception types worth retrying.
+    :type retryable: tuple
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except retryable as e:
+            if attempt == retries:
+                raise
+            delay = random.uniform(0, base_delay * 2**attempt)
+            logger.warning(f"LLM request failed ({e}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+class LLMBackend:
+    """
+    Chat completion backend.
+
+    ``complete`` returns the assistant message, or with ``stream=True`` an async
+    iterator of OpenAI-style chunks (``choices[0].delta``).
+    """
+
+    def __init__(self, model, timeout=60, retries=3, base_delay=0.5):
+        self.model = model
+        self.timeout = timeout
+        self.retries = retries
+        self.base_delay = base_delay
+
+    async def complete(self, messages, tools, tool_choice, stream=False):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class OpenAIBackend(LLMBackend):
+    """Backend using the openai package."""
+
+    RETRYABLE = (
+        openai.error.APIConnectionError,
+        openai.error.RateLimitError,
+        openai.error.ServiceUnavailableError,
+        openai.error.Timeout,
+    )
+
+    def __init__(self, model, api_base=None, **kwargs):
+        super().__init__(model, **kwargs)
+        self.api_base = api_base
+
+    async def complete(self, messages, tools, tool_choice, stream=False):
+        async def call():
+            return await openai.ChatCompletion.acreate(
+                model=self.model,
+                messages=messages,
+                tools=tools,
+                tool_choice=tool_choice,
+                stream=stream,
+                api_key=get_openai_api_key(),
+                api_base=self.api_base,
+                request_timeout=self.timeout,
+            )
+
+        response = await with_retries(
+            call, self.retries, self.base_delay, self.RETRYABLE
+        )
+        if stream:
+            return response
+        return response["choices"][0]["message"]
+
+
+class RetryableStatus(Exception):
+    pass
+
+
+class HTTPBackend(LLMBackend):
+    """
+    Backend for any OpenAI-compatible HTTP API, e.g. a self-hosted model or the
+    bundled stub server.
+
+    One ``httpx.AsyncClient`` is kept for the life of the backend so connections
+    are reused between requests.
+    """
+
+    RETRYABLE = (httpx.TransportError, RetryableStatus)
+
+    def __init__(self, model, api_base, api_key=None, max_connections=20, **kwargs):
+        # without api_key the key of the current credentials is sent
+        super().__init__(model, **kwargs)
+        self.api_base = api_base.rstrip("/")
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self._client = None
+
+    @property
+    def client(self):
+        # created lazily so it binds to the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_base,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    def _headers(self):
+        api_key = self.api_key or get_openai_api_key()
+        return {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+    def _check(self, response):
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableStatus(f"HTTP {response.status_code}")
+        response.raise_for_status()
+
+    async def complete(self, messages, tools, tool_choice, stream=False):
+        body = {
+            "model": self.model,
+            "messages": messages,
+            "tools": tools,
+            "tool_choice": tool_choice,
+            "stream": stream,
+        }
+
+        if not stream:
+
+            async def call():
+                response = await self.client.post(
+                    "/chat/completions", json=body, headers=self._headers()
+                )
+                self._check(response)
+                return response.json()
+
+            response = await with_retries(
+                call, self.retries, self.base_delay, self.RETRYABLE
+            )
+            return response["choices"][0]["message"]
+
+        async def connect():
+            request = self.client.build_request(
+                "POST", "/chat/completions", json=body, headers=self._headers()
+            )
+            response = await self.client.send(request, stream=True)
+            try:
+                self._check(response)
+            except Exception:
+                await response.aclose()
+                raise
+            return response
+
+        # only connecting is retried, a stream is never replayed halfway
+        response = await with_retries(
+            connect, self.retries, self.base_delay, self.RETRYABLE
+        )
+        return self._chunks(response)
+
+    async def _chunks(self, response):
+        try:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+                yield json.loads(data)
+        finally:
+            await response.aclose()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def create_backend(name, model, api_base=None, **kwargs):
+    """
+    Create the LLM backend selected in the configuration.
+
+    :param name: "openai" or "http".
+    :type name: str
+    """
+    if name == "openai":
+        return OpenAIBackend(model, api_base=api_base, **kwargs)
+    if name == "http":
+        return HTTPBackend(model, api_base or "https://api.openai.com/v1", **kwargs)
+    raise ValueError(f"Unknown LLM backend {name}")
@@ -0,0 +1,207 @@
+import json
+import logging
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# fields kept from the raw attrs of get_container, get_image and get_volume
+PROJECTIONS = {
+    "docker_container": [
+        "Id",
+        "Name",
+        "Created",
+        "State.Status",
+        "State.StartedAt",
+        "State.FinishedAt",
+        "State.ExitCode",
+        "State.Health.Status",
+        "RestartCount",
+        "Config.Image",
+        "Config.Cmd",
+        "Config.Entrypoint",
+        "HostConfig.RestartPolicy.Name",
+        "HostConfig.NetworkMode",
+        "NetworkSettings.Ports",
+        "Mounts",
+    ],
+    "docker_image": [
+        "Id",
+        "RepoTags",
+        "Created",
+        "Size",
+        "Architecture",
+        "Os",
+        "Config.Cmd",
+        "Config.Entrypoint",
+        "Config.ExposedPorts",
+    ],
+    "docker_volume": ["Name", "Driver", "Mountpoint", "CreatedAt", "Scope"],
+}
+
+# tokens added by the chat format for each message
+MESSAGE_OVERHEAD = 4
+
+
+class TokenCounter:
+    """Count tokens with tiktoken when installed, otherwise estimate 4 chars per token."""
+
+    def __init__(self, model):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return len(text) // 4 + 1
+
+    def count_messages(self, messages):
+        tokens = 0
+        for message in messages:
+            tokens += MESSAGE_OVERHEAD + self.count(message.get("content"))
+            for tool_call in message.get("tool_calls") or []:
+                tokens += self.count(tool_call["function"]["name"])
+                tokens += self.count(tool_call["function"]["arguments"])
+        return tokens
+
+
+def _project(attrs, paths):
+    projected = {}
+    for path in paths:
+        value = attrs
+        for key in path.split("."):
+            value = value.get(key) if isinstance(value, dict) else None
+        if value not in (None, "", [], {}):
+            projected[path] = value
+    return projected
+
+
+def _cell(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"))
+    return "" if value is None else str(value).replace("|", "/")
+
+
+def _table(name, rows, columns):
+    lines = [f"{name} ({len(rows)} rows):", "|".join(columns)]
+    lines += ["|".join(_cell(row.get(column)) for column in columns) for row in rows]
+    return lines
+
+
+class PromptBuilder:
+    """
+    Keep the prompt within a token budget.
+
+    Tool outputs over ``tool_output_budget`` tokens are compacted step by step:
+    raw attrs are projected to their useful fields, lists of objects are encoded
+    as a table instead of pretty JSON, nested columns are dropped, then only the
+    first rows are kept, and as a last resort the text is truncated. Older history
+    is dropped when the whole prompt exceeds ``prompt_budget`` tokens.
+    """
+
+    def __init__(self, model, tool_output_budget=1000, prompt_budget=3000):
+        self.counter = TokenCounter(model)
+        self.tool_output_budget = tool_output_budget
+        self.prompt_budget = prompt_budget
+
+    def fits(self, text):
+        return self.counter.count(text) <= self.tool_output_budget
+
+    def compact_tool_output(self, text):
+        """
+        Compact a tool output to the tool output budget.
+
+        :return: Compacted text and the number of tokens saved.
+        :rtype: tuple
+        """
+        if self.fits(text):
+            return text, 0
+
+        compacted = self._compact(text)
+        saved = self.counter.count(text) - self.counter.count(compacted)
+        return compacted, saved
+
+    def _compact(self, text):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return self._truncate(text)
+        if not isinstance(data, dict) or len(data) != 1:
+            return self._truncate(json.dumps(data, separators=(",", ":")))
+
+        name, value = next(iter(data.items()))
+        if name in PROJECTIONS and isinstance(value, dict):
+            value = _project(value, PROJECTIONS[name])
+        if not isinstance(value, list) or not all(isinstance(x, dict) for x in value):
+            return self._truncate(json.dumps({name: value}, separators=(",", ":")))
+
+        columns = list(dict.fromkeys(key for row in value for key in row))
+        lines = _table(name, value, columns)
+        if self.fits("\n".join(lines)):
+            return "\n".join(lines)
+
+        # drop the nested columns (ports, labels...) first
+        scalar_columns = [
+            column
+            for column in columns
+            if not any(isinstance(row.get(column), (dict, list)) for row in value)
+        ]
+        lines = _table(name, value, scalar_columns)
+        dropped = [column for column in columns if column not in scalar_columns]
+        if dropped:
+            lines[0] += f" dropped columns: {', '.join(dropped)}"
+        if self.fits("\n".join(lines)):
+            return "\n".join(lines)
+
+        # then keep the first rows that fit
+        kept = lines[:2]
+        tokens = self.counter.count("\n".join(kept)) + 10
+        for line in lines[2:]:
+            tokens += self.counter.count(line) + 1
+            if tokens > self.tool_output_budget:
+                break
+            kept.append(line)
+        kept.append(f"... {len(lines) - len(kept)} more rows not shown")
+        return "\n".join(kept)
+
+    def _truncate(self, text):
+        if self.fits(text):
+            return text
+        # shrink by the ratio over budget until it fits
+        limit = len(text)
+        while limit > 0 and not self.fits(text[:limit]):
+            limit = int(limit * self.tool_output_budget / self.counter.count(text[:limit]) * 0.9)
+        return f"{text[:limit]}... ({len(text) - limit} characters truncated)"
+
+    def fit(self, history, turn):
+        """
+        Drop the oldest history messages until the prompt fits the budget.
+
+        The messages of the running turn are always kept, and the history is cut
+        at a user message so tool calls keep their responses.
+
+        :return: Messages to send and the number of tokens dropped.
+        :rtype: tuple
+        """
+        header, history = history[:1], history[1:]
+        tokens = self.counter.count_messages(header + history + turn)
+        dropped = 0
+        while history and tokens > self.prompt_budget:
+            # drop the oldest question with everything that answered it
+            end = 1
+            while end < len(history) and history[end]["role"] != "user":
+                end += 1
+            removed = self.counter.count_messages(history[:end])
+            history = history[end:]
+            tokens -= removed
+            dropped += removed
+        return header + history + turn, dropped
@@ -0,0 +1,278 @@
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from docker import auth
+from docker.types import CancellableStream
+
+from heydocker.config import get_max_concurrent_pulls
+from heydocker.functions.cache import tool_cache
+from heydocker.functions.docker_client import get_client, is_local
+from heydocker.functions.utils import format_byte
+
+logger = logging.getLogger(__name__)
+
+# finished jobs kept for pull_status
+MAX_FINISHED_JOBS = 50
+# layers listed one by one in the progress message
+MAX_PROGRESS_LAYERS = 8
+
+# factory of the callback showing a job's progress to the user who started it,
+# set by the Telegram handler and inherited by the tool thread
+job_progress = contextvars.ContextVar("heydocker_job_progress", default=None)
+
+DONE_STATUSES = ("Pull complete", "Already exists")
+
+
+class PullJob:
+    def __init__(self, repository, tag, host=None):
+        self.id = uuid.uuid4().hex[:8]
+        self.repository = repository
+        self.tag = tag
+        self.host = host
+        self.status = "queued"
+        self.error = None
+        # layer id -> [status, current bytes, total bytes]
+        self.layers = OrderedDict()
+        self.started = time.time()
+        self.finished = None
+        self.cancelled = threading.Event()
+        self.listeners = []
+        self.lock = threading.Lock()
+        # the final state has been sent to the listeners
+        self.reported = False
+        self._stream = None
+
+    @property
+    def ref(self):
+        return f"{self.repository}:{self.tag}"
+
+    @property
+    def active(self):
+        return self.status in ("queued", "pulling")
+
+    def subscribe(self, listener):
+        """
+        :param listener: Called with the progress text and whether the job is
+            over, from the thread running the pull.
+        :type listener: callable
+        """
+        with self.lock:
+            self.listeners.append(listener)
+            reported = self.reported
+        # subscribed after the job ended, it would never hear of it otherwise
+        if reported:
+            listener(self.progress(), True)
+
+    def attach(self, stream):
+        """Keep the stream of the running pull so a cancel can hang it up."""
+        with self.lock:
+            self._stream = stream
+        if self.cancelled.is_set():
+            self.hang_up()
+
+    def hang_up(self):
+        with self.lock:
+            stream, self._stream = self._stream, None
+        if stream is None:
+            return
+        try:
+            stream.close()
+        except Exception as e:
+            logger.warning(f"Failed to close the stream of pull {self.id}: {e}")
+
+    def handle(self, event):
+        """Apply one event of the streaming pull API."""
+        if "error" in event:
+            raise RuntimeError(event["error"])
+        layer = event.get("id")
+        status = event.get("status", "")
+        if layer is None or status.startswith("Pulling from"):
+            return
+        detail = event.get("progressDetail") or {}
+        with self.lock:
+            current, total = self.layers.get(layer, [None, 0, 0])[1:]
+            if status in ("Downloading", "Extracting"):
+                current = detail.get("current", current)
+                total = detail.get("total", total)
+            self.layers[layer] = [status, current, total]
+
+    def progress(self):
+        """
+        :return: Status of the job and of its layers.
+        :rtype: str
+        """
+        with self.lock:
+            layers = list(self.layers.items())
+        done = sum(1 for _, (status, _, _) in layers if status in DONE_STATUSES)
+        downloaded = sum(
+            current for _, (status, current, _) in layers if status == "Downloading"
+        )
+        lines = [f"Pull {self.ref} (job {self.id}): {self.status}"]
+        if self.host:
+            lines[0] += f" on {self.host}"
+        if self.error:
+            lines.append(f"Error: {self.error}")
+        if layers:
+            lines.append(f"{done}/{len(layers)} layers done")
+        if downloaded:
+            lines[-1] += f", {format_byte(downloaded)} of the others downloaded"
+        active = [x for x in layers if x[1][0] not in DONE_STATUSES]
+        for layer, (status, current, total) in active[:MAX_PROGRESS_LAYERS]:
+            line = f"{layer}: {status}"
+            if total:
+                line += f" {format_byte(current)} / {format_byte(total)}"
+            lines.append(line)
+        if len(active) > MAX_PROGRESS_LAYERS:
+            lines.append(f"... {len(active) - MAX_PROGRESS_LAYERS} more layers")
+        return "\n".join(lines)
+
+    def notify(self):
+        with self.lock:
+            listeners = list(self.listeners)
+            self.reported = not self.active
+        text = self.progress()
+        for listener in listeners:
+            try:
+                listener(text, not self.active)
+            except Exception as e:
+                logger.warning(f"Failed to report progress of pull {self.id}: {e}")
+
+
+class PullManager:
+    """
+    Image pulls running in the background with a job id.
+
+    At most ``max_concurrent`` pulls download at once, the others wait in the
+    queue; how many layers of one pull download in parallel is up to the
+    daemon (``max-concurrent-downloads``). A pull of a ref already being
+    pulled on the same host joins the running job. Cancelling a job closes the
+    connection of its stream right away, which makes the daemon abort the pull.
+    """
+
+    def __init__(self, max_concurrent=2, notify_interval=0.5):
+        self.notify_interval = notify_interval
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix="heydocker-pull"
+        )
+
+    def start(self, repository, tag, host=None, listener=None):
+        """
+        Start pulling an image, or join the running pull of the same image.
+
+        :param listener: Subscribed to the job before it can run, see
+            :meth:`PullJob.subscribe`.
+        :type listener: callable
+        :return: The job, and whether it was created by this call.
+        :rtype: tuple
+        """
+        host = None if is_local(host) else host
+        key = (repository, tag, host)
+        with self._lock:
+            job = next(
+                (
+                    job for job in self.jobs.values()
+                    if (job.repository, job.tag, job.host) == key and job.active
+                ),
+                None,
+            )
+            created = job is None
+            if created:
+                job = PullJob(repository, tag, host)
+                self.jobs[job.id] = job
+                self._forget_finished()
+        if listener is not None:
+            job.subscribe(listener)
+        if created:
+            self._pool.submit(self._run, job)
+        return job, created
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        """
+        :return: Whether the job was running.
+        :rtype: bool
+        """
+        job = self.get(job_id)
+        if job is None or not job.active:
+            return False
+        job.cancelled.set()
+        job.hang_up()
+        return True
+
+    @staticmethod
+    def _open(client, repository, tag):
+        """
+        Start the streaming pull the way ``APIClient.pull`` does, but keep the
+        response so the stream can be closed from another thread.
+
+        :rtype: CancellableStream
+        """
+        api = client.api
+        registry, _ = auth.resolve_repository_name(repository)
+        headers = {}
+        header = auth.get_config_header(api, registry)
+        if header:
+            headers["X-Registry-Auth"] = header
+        response = api._post(
+            api._url("/images/create"),
+            params={"fromImage": repository, "tag": tag},
+            headers=headers,
+            stream=True,
+            timeout=None,
+        )
+        api._raise_for_status(response)
+        return CancellableStream(api._stream_helper(response, decode=True), response)
+
+    def _run(self, job):
+        if job.cancelled.is_set():
+            job.status = "cancelled"
+            job.finished = time.time()
+            job.notify()
+            return
+
+        job.status = "pulling"
+        job.notify()
+        next_notify = time.monotonic() + self.notify_interval
+        try:
+            stream = self._open(get_client(job.host), job.repository, job.tag)
+            job.attach(stream)
+            for event in stream:
+                if job.cancelled.is_set():
+                    break
+                job.handle(event)
+                if time.monotonic() >= next_notify:
+                    next_notify = time.monotonic() + self.notify_interval
+                    job.notify()
+            job.status = "cancelled" if job.cancelled.is_set() else "done"
+        except Exception as e:
+            logger.warning(f"Pull {job.ref} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.hang_up()
+            job.finished = time.time()
+            tool_cache.invalidate("images")
+        logger.info(f"Pull {job.ref} {job.status} in {job.finished - job.started:.1f}s")
+        job.notify()
+
+
+pull_manager = PullManager(max_concurrent=get_max_concurrent_pulls())
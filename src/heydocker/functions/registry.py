@@ -0,0 +1,208 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+
+from docstring_parser import parse
+
+logger = logging.getLogger(__name__)
+
+# bump when the generated schema format changes to invalidate cached schemas
+SCHEMA_VERSION = 1
+
+PYTHON_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "array": (list,),
+    "object": (dict,),
+}
+
+
+def generate_gpt_functions(available_functions):
+    """get all functions from functions.py"""
+    python_obj_to_json_obj = {
+        "str": "string",
+        "int": "integer",
+        "float": "number",
+        "bool": "boolean",
+        "list": "array",
+        "dict": "object",
+    }
+
+    gpt_functions = []
+
+    for function in available_functions:
+        name = function.__name__
+        docstring = inspect.getdoc(function)
+        docstring_obj = parse(docstring)
+        description = docstring_obj.short_description
+
+        properties = {}
+        for param in docstring_obj.params:
+            param_name = param.arg_name
+            param_type = param.type_name
+            param_description = param.description
+
+            properties[param_name] = {
+                "type": python_obj_to_json_obj[param_type],
+                "description": param_description,
+            }
+
+        gpt_functions.append(
+            {
+                "name": name,
+                "description": description,
+                "parameters": {"type": "object", "properties": properties},
+            }
+        )
+
+    return gpt_functions
+
+
+class ToolTiming:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, duration, failed):
+        self.calls += 1
+        self.errors += failed
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def to_json(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "average": self.total / self.calls if self.calls else 0.0,
+            "max": self.max,
+        }
+
+
+class ToolRegistry:
+    """
+    Tools exposed to the model, built once from the functions of a module.
+
+    The schemas generated from the docstrings are cached on disk keyed by a hash
+    of the module source, so a cold start does not parse every docstring again.
+    Calls are dispatched through a name -> function dict with JSON decoded and
+    type checked arguments, and the duration of every call is recorded.
+    """
+
+    def __init__(self, module, cache_dir=None):
+        self.module = module
+        self.cache_dir = cache_dir
+        self.functions = {
+            func.__name__: func
+            for func in module.__dict__.values()
+            if callable(func) and func.__module__ == module.__name__
+        }
+        self.schemas = self._load_schemas()
+        self.parameters = {
+            schema["name"]: schema["parameters"]["properties"] for schema in self.schemas
+        }
+        self.timings = {name: ToolTiming() for name in self.functions}
+        self._lock = threading.Lock()
+
+    def _module_hash(self):
+        with open(inspect.getsourcefile(self.module), "rb") as f:
+            source = f.read()
+        return hashlib.sha256(b"%d\0%s" % (SCHEMA_VERSION, source)).hexdigest()[:16]
+
+    def _load_schemas(self):
+        if self.cache_dir is None:
+            return generate_gpt_functions(self.functions.values())
+
+        cache_file = os.path.join(self.cache_dir, f"tools-{self._module_hash()}.json")
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file) as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring tool schema cache {cache_file}: {e}")
+
+        schemas = generate_gpt_functions(self.functions.values())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # write then rename so a concurrent start never reads half a file
+            with open(f"{cache_file}.{os.getpid()}", "w") as f:
+                json.dump(schemas, f)
+            os.replace(f"{cache_file}.{os.getpid()}", cache_file)
+        except OSError as e:
+            logger.warning(f"Failed to cache tool schemas: {e}")
+        return schemas
+
+    def decode_arguments(self, name, arguments):
+        """
+        Decode and validate the JSON arguments of a tool call.
+
+        :param name: Tool name.
+        :type name: str
+        :param arguments: JSON object sent by the model.
+        :type arguments: str
+        :return: Keyword arguments.
+        :rtype: dict
+        """
+        if name not in self.functions:
+            raise ValueError(f"Unknown function {name}")
+
+        kwargs = json.loads(arguments) if arguments else {}
+        if not isinstance(kwargs, dict):
+            raise ValueError(f"Arguments of {name} must be a JSON object")
+
+        # models send null for optional arguments they leave out
+        kwargs = {key: value for key, value in kwargs.items() if value is not None}
+
+        parameters = self.parameters[name]
+        for key, value in kwargs.items():
+            if key not in parameters:
+                raise ValueError(f"Unknown argument {key} for {name}")
+            expected = parameters[key]["type"]
+            # bool is a subclass of int but not a valid integer argument
+            if not isinstance(value, PYTHON_TYPES[expected]) or (
+                isinstance(value, bool) and expected != "boolean"
+            ):
+                raise ValueError(f"Argument {key} of {name} must be {expected}")
+        return kwargs
+
+    def call(self, name, arguments):
+        """
+        Call a tool with the JSON arguments sent by the model.
+
+        :return: Tool response.
+        :rtype: str
+        """
+        function = self.functions.get(name)
+        kwargs = self.decode_arguments(name, arguments)
+
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = function(**kwargs)
+            failed = False
+            return response
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.timings[name].record(duration, failed)
+            logger.info(f"Function {name} took {duration * 1000:.1f}ms")
+
+    def stats(self):
+        """
+        Get the call count, error count, average and maximum duration per tool.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                name: timing.to_json()
+                for name, timing in self.timings.items()
+                if timing.calls
+            }
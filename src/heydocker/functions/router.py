@@ -0,0 +1,175 @@
+import json
+import logging
+import math
+import re
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+STOP_WORDS = {
+    "a", "all", "an", "are", "can", "could", "do", "docker", "for", "have", "hey",
+    "i", "is", "me", "my", "of", "on", "please", "show", "the", "there", "tell",
+    "what", "whats", "which", "you",
+}
+
+# a message with one of these asks for a change, never answer it with a listing
+ACTION_VERBS = {
+    "create", "delete", "exec", "kill", "prune", "pull", "remove", "restart", "rm",
+    "rmi", "run", "start", "stop",
+}
+
+POLITE = re.compile(r"^((hey|hi|please|can you|could you|would you)\s+)+|(\s+please)$")
+
+
+def normalize(text):
+    text = re.sub(r"[^\w\s.:/-]", " ", text.lower())
+    text = re.sub(r"\s+", " ", text).strip(" .")
+    return POLITE.sub("", text).strip()
+
+
+def _words(text):
+    return Counter(word for word in re.findall(r"\w+", text) if word not in STOP_WORDS)
+
+
+def _cosine(a, b):
+    dot = sum(a[word] * b[word] for word in a)
+    norm = math.sqrt(sum(x * x for x in a.values())) * math.sqrt(
+        sum(x * x for x in b.values())
+    )
+    return dot / norm if norm else 0.0
+
+
+def format_containers(response):
+    containers = json.loads(response)["docker_containers"]
+    if not containers:
+        return "There are no containers."
+    lines = [
+        f"• {x['name']} ({x['image']}): {x['status']}, created {x['created']}"
+        for x in containers
+    ]
+    return f"You have {len(containers)} containers:\n" + "\n".join(lines)
+
+
+def format_images(response):
+    images = json.loads(response)["docker_images"]
+    if not images:
+        return "There are no images."
+    lines = [
+        f"• {', '.join(x['tags']) or x['short_id']}: {x['size'] / 1024 / 1024:.1f}MB, created {x['created']}"
+        for x in images
+    ]
+    return f"You have {len(images)} images:\n" + "\n".join(lines)
+
+
+def format_volumes(response):
+    volumes = json.loads(response)["docker_volumes"]
+    if not volumes:
+        return "There are no volumes."
+    lines = [f"• {x['name']}, created {x['created']}" for x in volumes]
+    return f"You have {len(volumes)} volumes:\n" + "\n".join(lines)
+
+
+def format_text(response):
+    return response
+
+
+class Intent:
+    def __init__(self, tool, patterns, template, examples=()):
+        self.tool = tool
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.template = template
+        self.examples = [_words(normalize(example)) for example in examples]
+
+
+# read-only commands only, anything that changes the host goes through the model
+INTENTS = [
+    Intent(
+        "list_containers",
+        [r"(list|get|show)( me)?( all| the)?( docker)? containers", r"(docker )?ps( -a)?"],
+        format_containers,
+        ["which containers do I have", "what containers are running", "containers list"],
+    ),
+    Intent(
+        "list_images",
+        [r"(list|get|show)( me)?( all| the)?( docker)? images", r"docker images"],
+        format_images,
+        ["which images do I have", "what images are there", "images list"],
+    ),
+    Intent(
+        "list_volumes",
+        [r"(list|get|show)( me)?( all| the)?( docker)? volumes", r"docker volume ls"],
+        format_volumes,
+        ["which volumes do I have", "what volumes are there", "volumes list"],
+    ),
+    Intent(
+        "check_disk_usage",
+        [r"((check|get|show)( me)? )?(the )?disk( usage| space)?", r"df( -h)?"],
+        format_text,
+        ["how much disk space is left", "how full is the disk"],
+    ),
+    Intent(
+        "check_ip",
+        [r"((check|get|show)( me)? |what is )?(my |the )?(public )?ip( address)?"],
+        format_text,
+        ["what is the ip address of the server"],
+    ),
+    Intent(
+        "stats_all_containers",
+        [r"((show|get)( me)? )?(all )?(container )?stats( of| for) all containers", r"docker stats"],
+        format_text,
+        ["how are all my containers doing", "resource usage of all containers"],
+    ),
+    Intent(
+        "stats_container",
+        [r"((show|get)( me)? )?(the )?(container )?stats (of |for )?(container )?(?P<container_name>[\w.-]+)"],
+        format_text,
+    ),
+]
+
+
+class IntentRouter:
+    """
+    Answer common read-only commands without the model.
+
+    A message is first matched against a small regex grammar. Messages that do
+    not match are scored against example phrases of the intents without
+    arguments (cosine similarity of their words); a score over ``threshold`` is a
+    match. Messages with an action verb or naming one of ``hosts`` (the tools
+    are answered by the local daemon), anything else, or any tool error go to
+    the model.
+    """
+
+    def __init__(self, intents=INTENTS, threshold=0.75, hosts=()):
+        self.intents = intents
+        self.threshold = threshold
+        self.hosts = {host.lower() for host in hosts}
+
+    def route(self, message):
+        """
+        Find the tool answering a message.
+
+        :return: Intent and tool arguments, or None when the model should answer.
+        :rtype: tuple
+        """
+        text = normalize(message)
+        words = set(text.split())
+        if ACTION_VERBS.intersection(words) or self.hosts.intersection(words):
+            return None
+
+        for intent in self.intents:
+            for pattern in intent.patterns:
+                match = pattern.fullmatch(text)
+                if match and match.groupdict().get("container_name") != "all":
+                    return intent, match.groupdict()
+
+        words = _words(text)
+        best, best_score = None, 0.0
+        for intent in self.intents:
+            for example in intent.examples:
+                score = _cosine(words, example)
+                if score > best_score:
+                    best, best_score = intent, score
+        if best is not None and best_score >= self.threshold:
+            logger.info(f"Routed to {best.tool} with score {best_score:.2f}")
+            return best, {}
+        return None
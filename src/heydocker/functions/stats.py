@@ -0,0 +1,294 @@
+import logging
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from heydocker.config import get_stats_history_size
+from heydocker.functions.docker_client import DockerClientManager
+from heydocker.functions.utils import parse_stats
+
+logger = logging.getLogger(__name__)
+
+FIELDS = (
+    "timestamp",
+    "cpu_percentage",
+    "mem_usage",
+    "mem_limit",
+    "net_rx",
+    "net_tx",
+    "block_read",
+    "block_write",
+    "pids",
+)
+
+# a sample older than this is not used to answer stats_container
+MAX_SAMPLE_AGE = 5
+# concurrent one-off stats requests when sampling all containers at once
+FAN_OUT_WORKERS = 32
+
+
+class StatsRingBuffer:
+    """
+    Fixed-size time series of one container.
+
+    Each field is stored in its own preallocated ``array('d')``, so a container
+    costs ``len(FIELDS) * size * 8`` bytes however long the bot runs.
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.columns = {field: array("d", bytes(8 * size)) for field in FIELDS}
+        self.count = 0
+        self.index = 0
+        self.lock = threading.Lock()
+
+    def append(self, timestamp, values):
+        with self.lock:
+            self.columns["timestamp"][self.index] = timestamp
+            for field in FIELDS[1:]:
+                self.columns[field][self.index] = values[field]
+            self.index = (self.index + 1) % self.size
+            self.count = min(self.count + 1, self.size)
+
+    def latest(self):
+        """
+        Get the newest sample.
+
+        :return: Sample, or None if nothing was recorded yet.
+        :rtype: dict
+        """
+        with self.lock:
+            if self.count == 0:
+                return None
+            index = (self.index - 1) % self.size
+            return {field: self.columns[field][index] for field in FIELDS}
+
+    def values(self, field, since):
+        """
+        Get the values of a field recorded after ``since``, oldest first.
+
+        :param field: One of FIELDS.
+        :type field: str
+        :param since: Unix timestamp.
+        :type since: float
+        """
+        with self.lock:
+            timestamps = self.columns["timestamp"]
+            column = self.columns[field]
+            start = (self.index - self.count) % self.size
+            indexes = ((start + i) % self.size for i in range(self.count))
+            return [column[i] for i in indexes if timestamps[i] >= since]
+
+
+class StatsSampler:
+    """
+    Background sampler of the stats of every running container.
+
+    Each running container gets a thread subscribed to the streaming stats API,
+    feeding a StatsRingBuffer. The list of running containers is refreshed every
+    ``refresh_interval`` seconds. The sampler uses its own Docker client so the
+    long-lived stats streams do not hold connections of the tools' pool.
+    """
+
+    def __init__(self, history_size=300, refresh_interval=10, max_containers=100):
+        self.history_size = history_size
+        self.refresh_interval = refresh_interval
+        self.max_containers = max_containers
+        self.buffers = {}
+        self._running = set()
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._client = DockerClientManager(pool_size=max_containers + FAN_OUT_WORKERS)
+        self._fan_out = ThreadPoolExecutor(
+            max_workers=FAN_OUT_WORKERS, thread_name_prefix="heydocker-stats-fan-out"
+        )
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="heydocker-stats", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Failed to refresh running containers: {e}")
+                self._client.reset()
+            time.sleep(self.refresh_interval)
+
+    def refresh(self):
+        """Start a stats stream for every running container not sampled yet."""
+        containers = self._client.get().api.containers(filters={"status": "running"})
+        running = set()
+        for container in containers[: self.max_containers]:
+            container_id = container["Id"]
+            running.add(container_id)
+            with self._lock:
+                if container_id in self._streams:
+                    continue
+                name = container["Names"][0].lstrip("/")
+                if container_id not in self.buffers:
+                    self.buffers[container_id] = StatsRingBuffer(name, self.history_size)
+                self.buffers[container_id].name = name
+                self._running.add(container_id)
+                thread = threading.Thread(
+                    target=self._stream,
+                    args=(container_id,),
+                    name=f"heydocker-stats-{name}",
+                    daemon=True,
+                )
+                self._streams[container_id] = thread
+            thread.start()
+
+        with self._lock:
+            # streams of stopped containers end on their next sample
+            self._running = running
+            # forget containers that are gone
+            for container_id in list(self.buffers):
+                if container_id not in running and container_id not in self._streams:
+                    del self.buffers[container_id]
+
+    def handle_event(self, event):
+        """Start sampling a container as soon as the events stream reports it."""
+        if self.running and event["Type"] == "container" and event["Action"] == "start":
+            self.refresh()
+
+    def _stream(self, container_id):
+        try:
+            stream = self._client.get().api.stats(container_id, stream=True, decode=True)
+            for stats in stream:
+                if container_id not in self._running:
+                    break
+                self.buffers[container_id].append(time.time(), parse_stats(stats))
+        except Exception as e:
+            logger.debug(f"Stats stream of {container_id} ended: {e}")
+        finally:
+            with self._lock:
+                del self._streams[container_id]
+
+    def find(self, container_name):
+        """
+        Get the buffer of a container by id, name or unique id prefix.
+
+        :return: Ring buffer, or None if the container is not sampled or the id
+            prefix is ambiguous.
+        :rtype: StatsRingBuffer
+        """
+        if not container_name:
+            return None
+        with self._lock:
+            buffers = list(self.buffers.items())
+        for container_id, buffer in buffers:
+            if container_id == container_name:
+                return buffer
+        for container_id, buffer in buffers:
+            if buffer.name == container_name:
+                return buffer
+        found = [
+            buffer for container_id, buffer in buffers
+            if container_id.startswith(container_name)
+        ]
+        return found[0] if len(found) == 1 else None
+
+    def latest_samples(self):
+        """
+        Get the newest sample of every sampled container.
+
+        :return: ``(container_id, name, sample)`` tuples.
+        :rtype: list
+        """
+        with self._lock:
+            buffers = list(self.buffers.items())
+        samples = []
+        for container_id, buffer in buffers:
+            sample = buffer.latest()
+            if sample is not None:
+                samples.append((container_id, buffer.name, sample))
+        return samples
+
+    def latest(self, container_name):
+        """
+        Get the newest sample of a container if it is recent enough.
+
+        :return: Sample, or None.
+        :rtype: dict
+        """
+        buffer = self.find(container_name)
+        if buffer is None:
+            return None
+        sample = buffer.latest()
+        if sample is None or time.time() - sample["timestamp"] > MAX_SAMPLE_AGE:
+            return None
+        return sample
+
+    def _fetch(self, container_id, client=None):
+        client = client or self._client.get()
+        stats = client.api.stats(container_id, stream=False)
+        return parse_stats(stats)
+
+    def snapshot(self, containers, client=None):
+        """
+        Get the current stats of many containers at once.
+
+        Containers with a fresh sample are answered from memory, the others are
+        requested concurrently so the whole call takes about one stats interval.
+
+        :param containers: Container names keyed by id.
+        :type containers: dict
+        :param client: Client of another Docker host, whose containers are not
+            sampled and are all requested.
+        :type client: docker.DockerClient
+        :return: Parsed stats, or the exception raised, keyed by container name.
+        :rtype: dict
+        """
+        results = {}
+        futures = {}
+        for container_id, name in containers.items():
+            sample = self.latest(container_id) if client is None else None
+            if sample is not None:
+                results[name] = sample
+            else:
+                futures[name] = self._fan_out.submit(self._fetch, container_id, client)
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = e
+        return results
+
+    def top(self, field, seconds=300, limit=5):
+        """
+        Rank containers by the average of a field over the last ``seconds``.
+
+        :return: Rows with name, average and maximum, highest average first.
+        :rtype: list
+        """
+        since = time.time() - seconds
+        with self._lock:
+            buffers = list(self.buffers.values())
+        rows = []
+        for buffer in buffers:
+            values = buffer.values(field, since)
+            if values:
+                rows.append(
+                    {
+                        "name": buffer.name,
+                        "average": sum(values) / len(values),
+                        "maximum": max(values),
+                    }
+                )
+        rows.sort(key=lambda row: row["average"], reverse=True)
+        return rows[:limit]
+
+
+stats_sampler = StatsSampler(history_size=get_stats_history_size())
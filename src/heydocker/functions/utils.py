@@ -1,6 +1,10 @@
+import json
+import re
+import time
 from datetime import datetime
 
 from dateutil.parser import isoparse
+from docker.types import CancellableStream
 
 
 def format_time_difference(created_str):
@@ -58,7 +62,9 @@ def convert_container_to_json(container):
     return {
         "short_id": container.short_id,
         "name": container.name,
-        "image": container.image.tags[0],
+        # the image reference the container was created from, like docker ps,
+        # instead of looking the image up once per container
+        "image": container.attrs["Config"]["Image"],
         "status": container.status,
         "created": format_time_difference(container.attrs["Created"]),
         "ports": container.attrs["NetworkSettings"]["Ports"],
@@ -101,54 +107,284 @@ def convert_volume_to_json(volume):
     }
 
 
-def convert_stats(stats):
+def parse_stats(stats):
     """
-    Convert container stats easier to understand.
+    Extract the numbers of a docker stats sample.
+
+    Missing sections, e.g. the empty ``precpu_stats`` of the first streamed
+    sample or a container without network, count as zero.
 
-    :param container_stats: _description_
-    :type container_stats: _type_
+    :param stats: Docker container stats.
+    :type stats: dict
+
+    :return: CPU %, memory, network, block I/O and pids figures.
+    :rtype: dict
     """
+    cpu_stats = stats.get("cpu_stats") or {}
+    precpu_stats = stats.get("precpu_stats") or {}
+
     # cpu %
-    total_usage = (
-        stats["cpu_stats"]["cpu_usage"]["total_usage"]
-        - stats["precpu_stats"]["cpu_usage"]["total_usage"]
-    )
-    system_cpu_usage = (
-        stats["cpu_stats"]["system_cpu_usage"]
-        - stats["precpu_stats"]["system_cpu_usage"]
+    total_usage = (cpu_stats.get("cpu_usage") or {}).get("total_usage", 0) - (
+        precpu_stats.get("cpu_usage") or {}
+    ).get("total_usage", 0)
+    system_cpu_usage = cpu_stats.get("system_cpu_usage", 0) - precpu_stats.get(
+        "system_cpu_usage", 0
     )
-    cpu_count = stats["cpu_stats"]["online_cpus"]
-    cpu_percentage = (total_usage / system_cpu_usage) * 100 * cpu_count
-    # convert float with 2 decimal
-    cpu_percentage = "{:.2f}%".format(cpu_percentage)
+    cpu_count = cpu_stats.get("online_cpus") or 1
+    cpu_percentage = 0.0
+    if total_usage > 0 and system_cpu_usage > 0:
+        cpu_percentage = (total_usage / system_cpu_usage) * 100 * cpu_count
 
     # mem usage / limit
-    mem_usage = stats["memory_stats"]["usage"]
-    mem_limit = stats["memory_stats"]["limit"]
-    # mem %
-    mem_percentage = (mem_usage / mem_limit) * 100
-    # convert float with 2 decimal
-    mem_percentage = "{:.2f}%".format(mem_percentage)
+    memory_stats = stats.get("memory_stats") or {}
+    mem_usage = memory_stats.get("usage", 0)
+    mem_limit = memory_stats.get("limit", 0)
 
-    # net i/o
-    net_rx = stats["networks"]["eth0"]["rx_bytes"]
-    net_tx = stats["networks"]["eth0"]["tx_bytes"]
+    # net i/o, summed over all interfaces
+    networks = (stats.get("networks") or {}).values()
+    net_rx = sum(network["rx_bytes"] for network in networks)
+    net_tx = sum(network["tx_bytes"] for network in networks)
 
     # block i/o
-    block_read = stats["blkio_stats"]["io_service_bytes_recursive"][0]["value"]
-    block_write = stats["blkio_stats"]["io_service_bytes_recursive"][1]["value"]
+    block_io = (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []
+    block_read = sum(x["value"] for x in block_io if x["op"].lower() == "read")
+    block_write = sum(x["value"] for x in block_io if x["op"].lower() == "write")
 
     # pids
-    pids = stats["pids_stats"]["current"]
+    pids = (stats.get("pids_stats") or {}).get("current", 0)
 
     return {
         "cpu_percentage": cpu_percentage,
-        "mem_usage": format_byte(mem_usage),
-        "mem_limit": format_byte(mem_limit),
-        "mem_percentage": mem_percentage,
+        "mem_usage": mem_usage,
+        "mem_limit": mem_limit,
         "net_rx": net_rx,
         "net_tx": net_tx,
-        "block_read": format_byte(block_read),
-        "block_write": format_byte(block_write),
+        "block_read": block_read,
+        "block_write": block_write,
         "pids": pids,
     }
+
+
+def format_stats(values):
+    """
+    Format the numbers returned by ``parse_stats`` to be easier to understand.
+
+    :param values: Parsed container stats.
+    :type values: dict
+    """
+    mem_percentage = 0.0
+    if values["mem_limit"]:
+        mem_percentage = (values["mem_usage"] / values["mem_limit"]) * 100
+
+    return {
+        # convert float with 2 decimal
+        "cpu_percentage": "{:.2f}%".format(values["cpu_percentage"]),
+        "mem_usage": format_byte(int(values["mem_usage"])),
+        "mem_limit": format_byte(int(values["mem_limit"])),
+        "mem_percentage": "{:.2f}%".format(mem_percentage),
+        "net_rx": int(values["net_rx"]),
+        "net_tx": int(values["net_tx"]),
+        "block_read": format_byte(int(values["block_read"])),
+        "block_write": format_byte(int(values["block_write"])),
+        "pids": int(values["pids"]),
+    }
+
+
+def convert_stats(stats):
+    """
+    Convert container stats easier to understand.
+
+    :param stats: Docker container stats.
+    :type stats: dict
+    """
+    return format_stats(parse_stats(stats))
+
+
+def format_stats_table(stats):
+    """
+    Format the stats of many containers as a table sorted by CPU usage.
+
+    :param stats: Parsed stats, or the exception raised, keyed by container name.
+    :type stats: dict
+
+    :return: One line per container, like docker stats.
+    :rtype: str
+    """
+    lines = ["NAME | CPU % | MEM USAGE / LIMIT | MEM % | NET I/O | BLOCK I/O | PIDS"]
+    failed = []
+    rows = []
+    for name, values in stats.items():
+        if isinstance(values, Exception):
+            failed.append(f"{name} | ERROR {values}")
+        else:
+            rows.append((values["cpu_percentage"], name, format_stats(values)))
+
+    for _, name, row in sorted(rows, key=lambda row: row[0], reverse=True):
+        lines.append(
+            f"{name} | {row['cpu_percentage']} | {row['mem_usage']} / {row['mem_limit']}"
+            f" | {row['mem_percentage']} | {format_byte(row['net_rx'])} / {format_byte(row['net_tx'])}"
+            f" | {row['block_read']} / {row['block_write']} | {row['pids']}"
+        )
+    return "\n".join(lines + failed)
+
+
+def merge_host_results(key, results):
+    """
+    Merge the JSON responses of a tool called on many hosts.
+
+    :param key: Key of the list in each response, e.g. "docker_containers".
+    :type key: str
+    :param results: Response, or the exception raised, keyed by host name.
+    :type results: dict
+
+    :return: The lists by host name, and the error of each host that failed.
+    :rtype: str
+    """
+    merged = {}
+    errors = {}
+    for host, result in results.items():
+        if isinstance(result, Exception):
+            errors[host] = f"{type(result).__name__}: {result}"
+        else:
+            merged[host] = json.loads(result)[key]
+
+    json_message = {f"{key}_by_host": merged}
+    if errors:
+        json_message["errors"] = errors
+    return json.dumps(json_message)
+
+
+def format_host_results(results):
+    """
+    Join the text responses of a tool called on many hosts.
+
+    :param results: Response, or the exception raised, keyed by host name.
+    :type results: dict
+    :rtype: str
+    """
+    sections = []
+    for host, result in results.items():
+        if isinstance(result, Exception):
+            result = f"ERROR {type(result).__name__}: {result}"
+        sections.append(f"[{host}]\n{result}")
+    return "\n\n".join(sections)
+
+
+LOG_TIME_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# numbers and hex ids, masked so lines differing only by them count as repeats
+LOG_VARIABLE = re.compile(r"\b[0-9a-f]{8,}\b|\d+")
+
+
+def parse_log_time(value):
+    """
+    Parse a log bound, relative to now ("30s", "15m", "2h", "1d") or an ISO 8601
+    time.
+
+    :param value: Log bound.
+    :type value: str
+
+    :return: Unix timestamp.
+    :rtype: int
+    """
+    match = re.fullmatch(r"(\d+)\s*([smhd])", value.strip())
+    if match:
+        return int(time.time()) - int(match.group(1)) * LOG_TIME_UNITS[match.group(2)]
+    return int(isoparse(value).timestamp())
+
+
+def open_log_stream(client, container, tail, since=None, until=None):
+    """
+    Stream the stdout and stderr of a container the way ``APIClient.logs``
+    does, but always keep the response so closing the stream hangs up.
+
+    :param since: Unix timestamp of the oldest line.
+    :param until: Unix timestamp of the newest line.
+    :rtype: CancellableStream
+    """
+    api = client.api
+    params = {"stdout": 1, "stderr": 1, "timestamps": 0, "follow": 0, "tail": tail}
+    if since is not None:
+        params["since"] = since
+    if until is not None:
+        params["until"] = until
+    response = api._get(
+        api._url("/containers/{0}/logs", container), params=params, stream=True
+    )
+    # demultiplexes the frames, or reads raw chunks for a TTY container
+    return CancellableStream(api._get_result(container, True, response), response)
+
+
+class LogSummary:
+    """
+    Log lines read chunk by chunk, filtered and deduplicated.
+
+    Only the lines matching ``pattern`` are kept, and lines differing only by
+    numbers or ids (timestamps, durations, request ids) are counted as repeats
+    of one line. Reading stops after ``max_bytes``, so memory and the summary
+    stay bounded whatever the size of the log.
+    """
+
+    def __init__(self, pattern=None, max_bytes=1024 * 1024):
+        self.pattern = pattern
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.lines_read = 0
+        self.matched = 0
+        self.truncated = False
+        # masked line -> [latest line, count], the most recent last
+        self.entries = {}
+        self._partial = b""
+
+    def feed(self, chunk):
+        """
+        :return: False once ``max_bytes`` have been read.
+        :rtype: bool
+        """
+        self.bytes_read += len(chunk)
+        *lines, self._partial = (self._partial + chunk).split(b"\n")
+        for line in lines:
+            self._add(line)
+        if self.bytes_read >= self.max_bytes:
+            self.truncated = True
+            return False
+        return True
+
+    def close(self):
+        if self._partial:
+            self._add(self._partial)
+            self._partial = b""
+
+    def _add(self, raw):
+        line = raw.decode("utf-8", errors="replace").rstrip("\r")
+        self.lines_read += 1
+        if self.pattern is not None and not self.pattern.search(line):
+            return
+        self.matched += 1
+        key = LOG_VARIABLE.sub("#", line)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            entry = [line, 0]
+        entry[0] = line
+        entry[1] += 1
+        self.entries[key] = entry
+
+    def format(self, max_lines=100):
+        """
+        :param max_lines: Distinct lines shown, the most recent ones.
+        :type max_lines: int
+        :rtype: str
+        """
+        header = (
+            f"{self.lines_read} lines read ({format_byte(self.bytes_read)}), "
+            f"{self.matched} matched, {len(self.entries)} distinct"
+        )
+        if self.truncated:
+            header += f", stopped after {format_byte(self.max_bytes)}"
+        entries = list(self.entries.values())
+        if len(entries) > max_lines:
+            header += f", showing the last {max_lines}"
+            entries = entries[-max_lines:]
+
+        lines = [f"[x{count}] {line}" if count > 1 else line for line, count in entries]
+        return "\n".join([header] + lines)
@@ -1,14 +1,44 @@
+import asyncio
+import atexit
+import html
+import importlib.util
 import logging
 import os
-from functools import wraps
+import secrets
+import time
+from functools import partial, wraps
 
 from telegram import ForceReply, Update
+from telegram.constants import ChatAction, MessageLimit
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (Application, CommandHandler, ContextTypes,
                           MessageHandler, filters)
 
-from heydocker.config import get_telegram_allowed_ids, get_telegram_token
+from heydocker.config import (credentials, get_concurrent_updates,
+                              get_db_flush_interval, get_db_flush_size,
+                              get_history_size,
+                              get_inventory_enabled, get_metrics_host,
+                              get_metrics_port, get_notify_socket,
+                              get_persist_conversations, get_restart_max_delay,
+                              get_stats_sampler_enabled,
+                              get_stream_edit_interval, get_stream_enabled,
+                              get_telegram_allowed_ids, get_telegram_token,
+                              get_trace_file, get_trace_format,
+                              get_webhook_cert, get_webhook_key,
+                              get_webhook_listen, get_webhook_path,
+                              get_webhook_port, get_webhook_secret,
+                              get_webhook_url)
 from heydocker.database import Database
-from heydocker.functions import run
+from heydocker.functions import gpt_client, run
+from heydocker.functions.cache import tool_cache
+from heydocker.functions.executor import chat_locks
+from heydocker.functions.gpt import tool_registry
+from heydocker.functions.inventory import inventory
+from heydocker.functions.pulls import job_progress
+from heydocker.functions.stats import stats_sampler
+from heydocker.metrics import (collect_containers, collect_spans, collect_tools,
+                               metrics, start_metrics_server)
+from heydocker.tracing import create_exporter, tracer
 
 # Enable logging
 logging.basicConfig(
@@ -21,8 +51,22 @@ logger = logging.getLogger(__name__)
 # check if database directory exists
 if not os.path.exists(os.path.expanduser("~/.heydocker")):
     os.makedirs(os.path.expanduser("~/.heydocker"))
-database = Database(os.path.expanduser("~/.heydocker/heydocker.db"))
+database = Database(
+    os.path.expanduser("~/.heydocker/heydocker.db"),
+    flush_interval=get_db_flush_interval(),
+    flush_size=get_db_flush_size(),
+    notify_socket=get_notify_socket(),
+    conversation_size=get_history_size(),
+)
 database.create_table()
+# log writes are batched on a background thread instead of committed inline
+database.start_writer()
+atexit.register(database.close)
+if get_persist_conversations():
+    gpt_client.conversations.attach(database)
+if get_trace_file():
+    tracer.add_exporter(create_exporter(get_trace_format(), get_trace_file()))
+    atexit.register(tracer.close)
 
 
 def check_user_allowed(command_handler):
@@ -30,10 +74,8 @@ def check_user_allowed(command_handler):
     async def wrapper(
         update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs
     ):
-        allowed_ids = get_telegram_allowed_ids()
-        logger.info(f"Allow IDs: {allowed_ids}")
-        id = update.effective_user.id
-        if id in allowed_ids:
+        # a frozenset from the credentials snapshot, no file is read here
+        if update.effective_user.id in get_telegram_allowed_ids():
             return await command_handler(update, context, *args, **kwargs)
         else:
             await update.message.reply_text(
@@ -43,6 +85,84 @@ def check_user_allowed(command_handler):
     return wrapper
 
 
+class StreamingReply:
+    """
+    Progressively edit one Telegram reply while the answer is generated.
+
+    Edits are rate-limited to one every ``interval`` seconds to stay within
+    Telegram's limits; intermediate texts received in between are skipped and the
+    final text is always sent by ``finish``.
+    """
+
+    def __init__(self, message, interval=1.0):
+        self.message = message
+        self.interval = interval
+        self.reply = None
+        self.sent_text = None
+        self.next_edit = 0.0
+
+    async def _send(self, text):
+        text = text[: MessageLimit.MAX_TEXT_LENGTH]
+        if text == self.sent_text:
+            return
+        try:
+            if self.reply is None:
+                self.reply = await self.message.reply_text(text)
+            else:
+                await self.reply.edit_text(text)
+            self.sent_text = text
+        except RetryAfter as e:
+            # flood control, hold the next edits back
+            self.next_edit = time.monotonic() + e.retry_after
+            raise
+        except BadRequest as e:
+            logger.warning(f"Failed to edit reply: {e}")
+
+    async def update(self, text):
+        if not text or time.monotonic() < self.next_edit:
+            return
+        self.next_edit = time.monotonic() + self.interval
+        try:
+            await self._send(text)
+        except RetryAfter:
+            pass
+
+    async def finish(self, text):
+        try:
+            await self._send(text)
+        except RetryAfter:
+            # the last text must get through, wait for the flood control
+            await asyncio.sleep(max(0.0, self.next_edit - time.monotonic()))
+            await self._send(text)
+
+
+class JobProgressReply:
+    """
+    Edit one reply with the progress of a background job.
+
+    Called from the job's thread; the edits run on the bot's event loop and
+    an update is skipped while the previous one is still being sent.
+    """
+
+    def __init__(self, message, loop, interval=1.0):
+        self.reply = StreamingReply(message, interval)
+        self.loop = loop
+        self._pending = None
+
+    def __call__(self, text, finished=False):
+        if finished:
+            asyncio.run_coroutine_threadsafe(self._finish(text), self.loop)
+        elif self._pending is None or self._pending.done():
+            self._pending = asyncio.run_coroutine_threadsafe(
+                self.reply.update(text), self.loop
+            )
+
+    async def _finish(self, text):
+        if self._pending is not None:
+            await asyncio.wrap_future(self._pending)
+        await self.reply.finish(text)
+
+
 # Define a few command handlers. These usually take the two arguments update and context.
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
@@ -59,44 +179,148 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     await update.message.reply_text("Help!")
 
 
+@check_user_allowed
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send the latency percentiles of every traced stage when /stats is issued."""
+    # monospace so the columns line up
+    text = html.escape(tracer.format_stats())[: MessageLimit.MAX_TEXT_LENGTH - 11]
+    await update.message.reply_html(f"<pre>{text}</pre>")
+
+
 @check_user_allowed
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the user message."""
-    logger.info(f"User question: {update.message.text}")
-    database.insert(update.message.from_user["username"], update.message.text)
-    response = run(update.message.text)
-    logger.info(f"Response message: {response}")
-    database.insert(None, response)
+    with tracer.span("handle_message", chat_id=update.effective_chat.id) as span:
+        started = time.perf_counter()
+        # messages of one chat are answered in order, other chats run concurrently
+        async with chat_locks.hold(update.effective_chat.id):
+            span.set(lock_wait_ms=(time.perf_counter() - started) * 1000)
+            # background jobs started by the tools report progress in this chat
+            job_progress.set(
+                partial(
+                    JobProgressReply,
+                    update.message,
+                    asyncio.get_running_loop(),
+                    get_stream_edit_interval(),
+                )
+            )
+            logger.info(f"User question: {update.message.text}")
+            database.insert(
+                update.message.from_user["username"],
+                update.message.text,
+                update.effective_chat.id,
+            )
+            reply = None
+            if get_stream_enabled():
+                # show typing right away, then edit one reply as the answer streams in
+                await update.effective_chat.send_action(ChatAction.TYPING)
+                reply = StreamingReply(update.message, get_stream_edit_interval())
+
+            response = await run(
+                update.message.text,
+                update.effective_chat.id,
+                reply.update if reply is not None else None,
+            )
+            logger.info(f"Response message: {response}")
+            database.insert(None, response, update.effective_chat.id)
 
-    await update.message.reply_text(response)
+            with tracer.span("telegram.reply", streamed=reply is not None):
+                if reply is not None:
+                    await reply.finish(response)
+                else:
+                    await update.message.reply_text(response)
 
 
 def main():
     """Start the bot."""
-    while True:
-        try:
-            token = get_telegram_token()
-
-            # Create the Application and pass it your bot's token.
-            application = (
-                Application.builder()
-                .token(token)
-                .read_timeout(60)
-                .write_timeout(60)
-                .build()
-            )
+    # pick up credentials rewritten by the Docker Desktop extension
+    credentials.start()
+    if get_inventory_enabled():
+        inventory.subscribe(stats_sampler.handle_event)
+        inventory.subscribe(tool_cache.handle_event)
+        inventory.start()
+    if get_stats_sampler_enabled():
+        stats_sampler.start()
+    if get_metrics_port() is not None:
+        metrics.add_collector(partial(collect_spans, tracer))
+        metrics.add_collector(partial(collect_tools, tool_registry))
+        # container figures come from the sampler, a scrape never calls Docker
+        metrics.add_collector(partial(collect_containers, stats_sampler))
+        start_metrics_server(metrics, get_metrics_host(), get_metrics_port())
 
-            # on different commands - answer in Telegram
-            application.add_handler(CommandHandler("start", start))
-            application.add_handler(CommandHandler("help", help_command))
+    if get_webhook_url() is not None and importlib.util.find_spec("tornado") is None:
+        raise SystemExit("Webhook mode needs: pip install 'heydocker[webhooks]'")
 
-            # on non command i.e message - echo the message on Telegram
-            application.add_handler(
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
-            )
+    supervise(run_bot, max_delay=get_restart_max_delay())
+
+
+def build_application():
+    # Create the Application and pass it your bot's token.
+    application = (
+        Application.builder()
+        .token(get_telegram_token())
+        .read_timeout(60)
+        .write_timeout(60)
+        .concurrent_updates(get_concurrent_updates())
+        .build()
+    )
+
+    # on different commands - answer in Telegram
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("stats", stats_command))
 
-            # Run the bot until the user presses Ctrl-C
-            application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # on non command i.e message - echo the message on Telegram
+    application.add_handler(
+        MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
+    )
+    return application
+
+
+def run_bot():
+    """Run the bot until the user presses Ctrl-C, with a webhook when configured."""
+    application = build_application()
+    webhook_url = get_webhook_url()
+    # close_loop=False: the event loop is reused when the bot is restarted
+    if webhook_url is None:
+        application.run_polling(allowed_updates=Update.ALL_TYPES, close_loop=False)
+        return
+
+    # updates are pushed by Telegram to <webhook_url>/<path>
+    path = get_webhook_path().strip("/")
+    application.run_webhook(
+        listen=get_webhook_listen(),
+        port=get_webhook_port(),
+        url_path=path,
+        webhook_url=f"{webhook_url.rstrip('/')}/{path}",
+        secret_token=get_webhook_secret() or secrets.token_urlsafe(32),
+        cert=get_webhook_cert(),
+        key=get_webhook_key(),
+        allowed_updates=Update.ALL_TYPES,
+        close_loop=False,
+    )
+
+
+def supervise(run_forever, initial_delay=1.0, max_delay=300.0, healthy_after=60.0):
+    """
+    Restart ``run_forever`` when it raises, waiting twice as long after every
+    failure in a row, up to ``max_delay`` seconds.
+
+    :param run_forever: Function returning only when the bot is stopped on purpose.
+    :type run_forever: callable
+    :param healthy_after: Seconds of running after which the delay is reset.
+    :type healthy_after: float
+    """
+    delay = initial_delay
+    while True:
+        started = time.monotonic()
+        try:
+            run_forever()
+            return
         except Exception as e:
-            logger.error(e)
-            continue
+            logger.error(f"Bot stopped: {e}")
+        if time.monotonic() - started > healthy_after:
+            delay = initial_delay
+        logger.info(f"Restarting the bot in {delay:.0f}s")
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
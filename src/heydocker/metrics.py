@@ -0,0 +1,195 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# counters incremented on the hot path: name -> help
+COUNTERS = {
+    "heydocker_llm_tokens_total": "Tokens sent to and received from the model, estimated.",
+    "heydocker_llm_requests_total": "Completions requested from the model.",
+}
+
+# sampler field -> metric name, type and help
+CONTAINER_METRICS = {
+    "cpu_percentage": ("heydocker_container_cpu_percent", "gauge", "CPU usage in percent of one CPU."),
+    "mem_usage": ("heydocker_container_memory_usage_bytes", "gauge", "Memory usage."),
+    "mem_limit": ("heydocker_container_memory_limit_bytes", "gauge", "Memory limit."),
+    "net_rx": ("heydocker_container_network_receive_bytes_total", "counter", "Bytes received on all interfaces."),
+    "net_tx": ("heydocker_container_network_transmit_bytes_total", "counter", "Bytes sent on all interfaces."),
+    "block_read": ("heydocker_container_block_read_bytes_total", "counter", "Bytes read from block devices."),
+    "block_write": ("heydocker_container_block_write_bytes_total", "counter", "Bytes written to block devices."),
+    "pids": ("heydocker_container_pids", "gauge", "Number of processes."),
+    "timestamp": ("heydocker_container_last_sample_timestamp_seconds", "gauge", "Time of the newest sample."),
+}
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """
+    Metrics in the Prometheus text format.
+
+    The hot path only increments counters. Everything else is read on scrape
+    from figures already kept in memory (span histograms, tool timings, the
+    stats sampler's buffers) by collectors, so a scrape never calls Docker and
+    costs the same however often it happens.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_collector(self, collector):
+        """
+        :param collector: Function returning families as ``(name, type, help,
+            samples)`` with samples as ``(suffix, labels, value)``.
+        :type collector: callable
+        """
+        self._collectors.append(collector)
+
+    def _counter_families(self):
+        with self._lock:
+            counters = list(self._counters.items())
+        families = {}
+        for (name, labels), value in counters:
+            families.setdefault(name, []).append(("", dict(labels), value))
+        return [
+            (name, "counter", COUNTERS.get(name, name), samples)
+            for name, samples in families.items()
+        ]
+
+    def render(self):
+        families = self._counter_families()
+        for collector in self._collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector {collector} failed: {e}")
+
+        lines = []
+        for name, type, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            for suffix, labels, value in samples:
+                lines.append(
+                    f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+def collect_spans(tracer):
+    """Durations and errors of the traced stages, ``handle_message`` being a request."""
+    histograms = []
+    errors = []
+    for name, (histogram, error_count) in tracer.histogram_snapshot().items():
+        labels = {"span": name}
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            histograms.append(("_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+        histograms.append(("_bucket", {**labels, "le": "+Inf"}, histogram.count))
+        histograms.append(("_sum", labels, histogram.sum))
+        histograms.append(("_count", labels, histogram.count))
+        errors.append(("", labels, error_count))
+    return [
+        (
+            "heydocker_span_duration_seconds",
+            "histogram",
+            "Duration of the stages of answering a message.",
+            histograms,
+        ),
+        ("heydocker_span_errors_total", "counter", "Stages that raised an error.", errors),
+    ]
+
+
+def collect_tools(registry):
+    """Calls and errors of every tool the model or the router ran."""
+    stats = registry.stats()
+    return [
+        (
+            "heydocker_tool_calls_total",
+            "counter",
+            "Tool calls.",
+            [("", {"tool": name}, row["calls"]) for name, row in sorted(stats.items())],
+        ),
+        (
+            "heydocker_tool_errors_total",
+            "counter",
+            "Tool calls that raised an error.",
+            [("", {"tool": name}, row["errors"]) for name, row in sorted(stats.items())],
+        ),
+    ]
+
+
+def collect_containers(sampler):
+    """The newest sample of every container the stats sampler is streaming."""
+    samples = {field: [] for field in CONTAINER_METRICS}
+    for container_id, name, sample in sampler.latest_samples():
+        labels = {"container": name, "id": container_id[:12]}
+        for field in CONTAINER_METRICS:
+            samples[field].append(("", labels, sample[field]))
+    return [
+        (name, type, help, samples[field])
+        for field, (name, type, help) in CONTAINER_METRICS.items()
+    ]
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    metrics = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        if self.path.partition("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        payload = self.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_metrics_server(metrics, host, port):
+    """
+    Serve ``/metrics`` on a background thread.
+
+    :rtype: ThreadingHTTPServer
+    """
+    handler = type("Handler", (MetricsHandler,), {"metrics": metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="heydocker-metrics", daemon=True
+    ).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
+
+
+metrics = Metrics()
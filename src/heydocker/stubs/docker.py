@@ -0,0 +1,360 @@
+import argparse
+import json
+import os
+import re
+import struct
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs
+
+API_VERSION = "1.45"
+CREATED = "2024-01-01T00:00:00.000000000Z"
+
+
+def make_container(index):
+    container_id = f"{index:04x}" * 16
+    return {
+        "Id": container_id,
+        "Name": f"/web-{index}",
+        "Created": CREATED,
+        "Image": f"sha256:{'ab' * 32}",
+        "State": {"Status": "running", "Running": True, "StartedAt": CREATED, "ExitCode": 0},
+        "RestartCount": 0,
+        "Config": {
+            "Image": "nginx:latest",
+            "Tty": False,
+            "Cmd": ["nginx", "-g", "daemon off;"],
+            "Labels": {"com.docker.compose.project": "stub", "index": str(index)},
+        },
+        "HostConfig": {"NetworkMode": "bridge", "RestartPolicy": {"Name": "always"}},
+        "NetworkSettings": {
+            "Ports": {"80/tcp": [{"HostIp": "0.0.0.0", "HostPort": str(8000 + index)}]}
+        },
+        "Mounts": [],
+    }
+
+
+def make_stats(index, sample):
+    return {
+        "read": time.strftime("%Y-%m-%dT%H:%M:%S.000000000Z", time.gmtime()),
+        "cpu_stats": {
+            "cpu_usage": {"total_usage": 10_000_000 * (sample + 1) * (index % 7 + 1)},
+            "system_cpu_usage": 1_000_000_000 * (sample + 1),
+            "online_cpus": 4,
+        },
+        "precpu_stats": {
+            "cpu_usage": {"total_usage": 10_000_000 * sample * (index % 7 + 1)},
+            "system_cpu_usage": 1_000_000_000 * sample,
+        },
+        "memory_stats": {"usage": (index + 1) * 32 * 1024 * 1024, "limit": 8 * 1024**3},
+        "networks": {"eth0": {"rx_bytes": 1000 * sample, "tx_bytes": 500 * sample}},
+        "blkio_stats": {
+            "io_service_bytes_recursive": [
+                {"major": 8, "minor": 0, "op": "read", "value": 4096 * index},
+                {"major": 8, "minor": 0, "op": "write", "value": 1024 * index},
+            ]
+        },
+        "pids_stats": {"current": 3},
+    }
+
+
+def make_log_line(index):
+    if index % 97 == 0:
+        return f"2024-01-01T00:{index // 60 % 60:02d}:{index % 60:02d}Z ERROR connect() to db:5432 failed (111: Connection refused)"
+    if index % 10 == 0:
+        return f"2024-01-01T00:{index // 60 % 60:02d}:{index % 60:02d}Z WARN upstream slow response: {index * 7 % 900}ms"
+    return f'172.17.0.{index % 250} - - "GET /health HTTP/1.1" 200 {index % 13 + 2}'
+
+
+class StubDocker:
+    """
+    Canned Docker Engine API state: ``containers`` running nginx containers, one
+    image and one volume. One-shot stats take ``stats_delay`` seconds, like the
+    real daemon collecting two samples.
+    """
+
+    def __init__(self, containers=10, stats_delay=1.0, log_lines=1000, pull_delay=0.05):
+        self.stats_delay = stats_delay
+        self.log_lines = log_lines
+        # between two events of an image pull
+        self.pull_delay = pull_delay
+        self.containers = [make_container(index) for index in range(containers)]
+        self.images = [
+            {
+                "Id": f"sha256:{'ab' * 32}",
+                "RepoTags": ["nginx:latest"],
+                "Created": CREATED,
+                "Size": 187 * 1024 * 1024,
+                "Architecture": "amd64",
+                "Os": "linux",
+                "Config": {"Cmd": ["nginx", "-g", "daemon off;"]},
+            }
+        ]
+        self.volumes = [
+            {
+                "Name": "data",
+                "Driver": "local",
+                "Mountpoint": "/var/lib/docker/volumes/data/_data",
+                "CreatedAt": CREATED,
+                "Scope": "local",
+            }
+        ]
+
+    def find_container(self, name):
+        for index, container in enumerate(self.containers):
+            if container["Id"].startswith(name) or container["Name"] == f"/{name}":
+                return index, container
+        return None, None
+
+    def summary(self, container):
+        return {
+            "Id": container["Id"],
+            "Names": [container["Name"]],
+            "Image": container["Config"]["Image"],
+            "ImageID": container["Image"],
+            "State": container["State"]["Status"],
+            "Status": "Up 2 days",
+            "Labels": container["Config"]["Labels"],
+        }
+
+
+class StubDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stub = None
+
+    def address_string(self):
+        return "docker.sock"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Api-Version", API_VERSION)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def start_stream(self, content_type="application/json"):
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def route(self):
+        path, _, query = self.path.partition("?")
+        # the API version prefix is optional
+        path = re.sub(r"^/v[\d.]+", "", path)
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+        return path, params
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Api-Version", API_VERSION)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        stub = self.stub
+        path, params = self.route()
+        try:
+            if path == "/_ping":
+                payload = b"OK"
+                self.send_response(200)
+                self.send_header("Api-Version", API_VERSION)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            elif path == "/version":
+                self.send_json(
+                    200,
+                    {"ApiVersion": API_VERSION, "Version": "stub", "MinAPIVersion": "1.24"},
+                )
+            elif path == "/containers/json":
+                self.send_json(200, [stub.summary(x) for x in stub.containers])
+            elif path == "/images/json":
+                self.send_json(
+                    200, [{"Id": x["Id"], "RepoTags": x["RepoTags"]} for x in stub.images]
+                )
+            elif path == "/volumes":
+                self.send_json(200, {"Volumes": stub.volumes, "Warnings": None})
+            elif path == "/events":
+                # never sends anything, like a daemon where nothing happens
+                self.start_stream()
+                while True:
+                    time.sleep(60)
+            elif re.fullmatch(r"/containers/[^/]+/json", path):
+                _, container = stub.find_container(path.split("/")[2])
+                self.send_found(container)
+            elif re.fullmatch(r"/containers/[^/]+/logs", path):
+                self.logs(path.split("/")[2], params.get("tail", "all"))
+            elif re.fullmatch(r"/containers/[^/]+/stats", path):
+                self.stats(path.split("/")[2], params.get("stream", "1") in ("1", "true"))
+            elif re.fullmatch(r"/images/.+/json", path):
+                name = path[len("/images/") : -len("/json")]
+                image = next(
+                    (x for x in stub.images if x["Id"] == name or name in x["RepoTags"]),
+                    None,
+                )
+                self.send_found(image)
+            elif re.fullmatch(r"/volumes/[^/]+", path):
+                name = path.split("/")[2]
+                self.send_found(next((x for x in stub.volumes if x["Name"] == name), None))
+            else:
+                self.send_json(404, {"message": f"page not found: {path}"})
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        path, params = self.route()
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if path == "/images/create":
+            try:
+                self.pull(params.get("fromImage", ""), params.get("tag", "latest"))
+            except (BrokenPipeError, ConnectionResetError):
+                # the client hung up, a real daemon cancels the pull
+                pass
+            return
+        match = re.fullmatch(r"/containers/([^/]+)/(start|stop|restart)", path)
+        if match is None:
+            self.send_json(404, {"message": f"page not found: {path}"})
+            return
+        _, container = self.stub.find_container(match.group(1))
+        if container is None:
+            self.send_found(None)
+            return
+        container["State"]["Status"] = "exited" if match.group(2) == "stop" else "running"
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def pull(self, image, tag):
+        self.start_stream()
+
+        def send(event):
+            self.send_chunk(json.dumps(event).encode() + b"\r\n")
+            time.sleep(self.stub.pull_delay)
+
+        send({"status": f"Pulling from {image}", "id": tag})
+        if "missing" in image:
+            send({"errorDetail": {"message": "manifest unknown"}, "error": "manifest unknown"})
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        layers = [f"{index:02x}" * 6 for index in range(1, 4)]
+        for layer in layers:
+            send({"status": "Pulling fs layer", "progressDetail": {}, "id": layer})
+        total = 10 * 1024 * 1024
+        for layer in layers:
+            for step in range(1, 6):
+                detail = {"current": total * step // 5, "total": total}
+                send({"status": "Downloading", "progressDetail": detail, "id": layer})
+            send({"status": "Download complete", "progressDetail": {}, "id": layer})
+            send({"status": "Pull complete", "progressDetail": {}, "id": layer})
+        send({"status": f"Digest: sha256:{'cd' * 32}"})
+        send({"status": f"Status: Downloaded newer image for {image}:{tag}"})
+        self.wfile.write(b"0\r\n\r\n")
+        self.stub.images.append(
+            {
+                "Id": f"sha256:{'cd' * 32}",
+                "RepoTags": [f"{image}:{tag}"],
+                "Created": CREATED,
+                "Size": 3 * total,
+            }
+        )
+
+    def send_found(self, body):
+        if body is None:
+            self.send_json(404, {"message": "No such object"})
+        else:
+            self.send_json(200, body)
+
+    def logs(self, name, tail):
+        _, container = self.stub.find_container(name)
+        if container is None:
+            self.send_found(None)
+            return
+        count = self.stub.log_lines
+        start = 0 if tail == "all" else max(0, count - int(tail))
+        self.start_stream("application/vnd.docker.multiplexed-stream")
+        for index in range(start, count):
+            line = make_log_line(index).encode() + b"\n"
+            # stdout frames, stderr for the errors, as a container without a tty
+            stream_type = 2 if b"ERROR" in line else 1
+            self.send_chunk(struct.pack(">BxxxL", stream_type, len(line)) + line)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def stats(self, name, stream):
+        index, container = self.stub.find_container(name)
+        if container is None:
+            self.send_found(None)
+            return
+        if not stream:
+            time.sleep(self.stub.stats_delay)
+            self.send_json(200, make_stats(index, 1))
+            return
+        self.start_stream()
+        sample = 0
+        while True:
+            sample += 1
+            self.send_chunk(json.dumps(make_stats(index, sample)).encode() + b"\n")
+            time.sleep(1)
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path=None, port=None, containers=10, stats_delay=1.0, log_lines=1000):
+    """
+    Create a stub Docker daemon on a unix socket, or on a TCP port when
+    ``socket_path`` is None, call ``serve_forever()`` on it to run it.
+
+    :rtype: socketserver.BaseServer
+    """
+    handler = type(
+        "Handler",
+        (StubDockerHandler,),
+        {"stub": StubDocker(containers, stats_delay, log_lines)},
+    )
+    if socket_path is None:
+        handler.disable_nagle_algorithm = True
+        server = ThreadingHTTPServer(("127.0.0.1", port or 0), handler)
+        server.daemon_threads = True
+        return server
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    return ThreadingUnixHTTPServer(socket_path, handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub Docker daemon with canned responses.")
+    parser.add_argument("--socket", help="unix socket path, e.g. /tmp/docker.sock")
+    parser.add_argument("--port", type=int, help="TCP port when no socket is given")
+    parser.add_argument("--containers", type=int, default=10)
+    parser.add_argument("--stats-delay", type=float, default=1.0)
+    parser.add_argument("--log-lines", type=int, default=1000)
+    args = parser.parse_args()
+
+    server = serve(
+        args.socket, args.port, args.containers, args.stats_delay, args.log_lines
+    )
+    if args.socket:
+        print(f"Stub Docker daemon listening on unix://{args.socket}")
+    else:
+        print(f"Stub Docker daemon listening on tcp://127.0.0.1:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
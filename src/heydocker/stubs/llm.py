@@ -0,0 +1,202 @@
+import argparse
+import itertools
+import json
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# recorded exchanges: the first one whose "match" is found in the user message
+# answers it, by calling "tool_calls" first when present, then with "answer"
+# where {tool_output} is replaced by the tool responses
+DEFAULT_RECORDINGS = [
+    {
+        "match": "stats|cpu|memory",
+        "tool_calls": [{"name": "stats_all_containers", "arguments": {}}],
+        "answer": "Here are the stats of your containers:\n{tool_output}",
+    },
+    {
+        "match": "container",
+        "tool_calls": [{"name": "list_containers", "arguments": {}}],
+        "answer": "Here are your containers:\n{tool_output}",
+    },
+    {
+        "match": "image",
+        "tool_calls": [{"name": "list_images", "arguments": {}}],
+        "answer": "Here are your images:\n{tool_output}",
+    },
+    {
+        "match": "volume",
+        "tool_calls": [{"name": "list_volumes", "arguments": {}}],
+        "answer": "Here are your volumes:\n{tool_output}",
+    },
+    {
+        "match": "disk",
+        "tool_calls": [{"name": "check_disk_usage", "arguments": {}}],
+        "answer": "{tool_output}",
+    },
+    {"match": "", "answer": "I can help you monitor and control your docker server."},
+]
+
+
+class StubLLM:
+    """Replay recorded function-call exchanges like an OpenAI chat completion API."""
+
+    def __init__(self, recordings, latency=0.0):
+        self.recordings = [
+            dict(recording, pattern=re.compile(recording["match"], re.IGNORECASE))
+            for recording in recordings
+        ]
+        self.latency = latency
+        self._ids = itertools.count()
+
+    def find(self, messages):
+        question = next(
+            (m["content"] for m in reversed(messages) if m["role"] == "user"), ""
+        )
+        for recording in self.recordings:
+            if recording["pattern"].search(question or ""):
+                return recording
+        return {"answer": ""}
+
+    def reply(self, messages):
+        """
+        Get the assistant message answering a conversation.
+
+        :rtype: dict
+        """
+        recording = self.find(messages)
+        if messages[-1]["role"] == "user" and recording.get("tool_calls"):
+            return {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": f"call_{next(self._ids)}",
+                        "type": "function",
+                        "function": {
+                            "name": tool_call["name"],
+                            "arguments": json.dumps(tool_call["arguments"]),
+                        },
+                    }
+                    for tool_call in recording["tool_calls"]
+                ],
+            }
+
+        tool_output = []
+        for message in reversed(messages):
+            if message["role"] != "tool":
+                break
+            tool_output.insert(0, message["content"])
+        return {
+            "role": "assistant",
+            "content": recording["answer"].replace("{tool_output}", "\n".join(tool_output)),
+        }
+
+
+def chunks(message):
+    """Split an assistant message into streamed chunks."""
+    if message.get("tool_calls"):
+        yield {
+            "role": "assistant",
+            "tool_calls": [
+                dict(tool_call, index=index)
+                for index, tool_call in enumerate(message["tool_calls"])
+            ],
+        }
+        return
+    for word in re.findall(r"\S+\s*", message["content"] or ""):
+        yield {"content": word}
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, without this every response
+    # waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+    stub = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        time.sleep(self.stub.latency)
+        message = self.stub.reply(body["messages"])
+        if not body.get("stream"):
+            self.send_json(
+                200,
+                {
+                    "object": "chat.completion",
+                    "model": body.get("model"),
+                    "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                },
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        events = [
+            {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": delta}]}
+            for delta in chunks(message)
+        ]
+        for data in [json.dumps(event) for event in events] + ["[DONE]"]:
+            payload = f"data: {data}\n\n".encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def serve(host="127.0.0.1", port=8089, recordings=None, latency=0.0):
+    """
+    Create a stub LLM server, call ``serve_forever()`` on it to run it.
+
+    :rtype: ThreadingHTTPServer
+    """
+    handler = type(
+        "Handler",
+        (StubLLMHandler,),
+        {"stub": StubLLM(recordings or DEFAULT_RECORDINGS, latency)},
+    )
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="OpenAI-compatible stub server replaying recorded responses."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--recordings", help="JSON file with recorded exchanges")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds to wait before answering"
+    )
+    args = parser.parse_args()
+
+    recordings = None
+    if args.recordings:
+        with open(args.recordings) as f:
+            recordings = json.load(f)
+
+    server = serve(args.host, args.port, recordings, args.latency)
+    print(f"Stub LLM listening on http://{args.host}:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import itertools
+import time
+
+_message_ids = itertools.count(1)
+
+
+class FakeUser(dict):
+    """
+    Telegram user, subscriptable like the ``from_user`` handlers read the
+    username from.
+    """
+
+    def __init__(self, id, username):
+        super().__init__(id=id, username=username)
+        self.id = id
+        self.username = username
+
+
+class FakeChat:
+    def __init__(self, id):
+        self.id = id
+        self.actions = []
+
+    async def send_action(self, action, **kwargs):
+        self.actions.append(action)
+
+
+class FakeMessage:
+    """
+    Message recording when the bot first answered it and when the answer was
+    last edited, the timestamps the benchmark measures latency with.
+    """
+
+    def __init__(self, text, chat, from_user):
+        self.message_id = next(_message_ids)
+        self.text = text
+        self.chat = chat
+        self.from_user = from_user
+        self.created = time.perf_counter()
+        self.replies = []
+        self.first_reply = None
+        self.last_reply = None
+        self.edits = 0
+
+    def _record(self):
+        now = time.perf_counter()
+        if self.first_reply is None:
+            self.first_reply = now
+        self.last_reply = now
+
+    async def reply_text(self, text, **kwargs):
+        self._record()
+        reply = FakeReply(self, text)
+        self.replies.append(reply)
+        return reply
+
+    async def reply_html(self, text, **kwargs):
+        return await self.reply_text(text, **kwargs)
+
+    @property
+    def answer(self):
+        return self.replies[-1].text if self.replies else None
+
+
+class FakeReply:
+    def __init__(self, question, text):
+        self.message_id = next(_message_ids)
+        self.question = question
+        self.text = text
+
+    async def edit_text(self, text, **kwargs):
+        self.question._record()
+        self.question.edits += 1
+        self.text = text
+        return self
+
+
+class FakeUpdate:
+    def __init__(self, text, chat_id=1, user_id=1, username="bench"):
+        self.effective_chat = FakeChat(chat_id)
+        self.effective_user = FakeUser(user_id, username)
+        self.message = FakeMessage(text, self.effective_chat, self.effective_user)
@@ -0,0 +1,285 @@
+import contextvars
+import json
+import logging
+import secrets
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# upper bounds in seconds, the same as the Prometheus client defaults plus 30s/60s
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0, 30.0, 60.0)
+
+_current_span = contextvars.ContextVar("heydocker_current_span", default=None)
+
+
+class Histogram:
+    """
+    Durations counted in fixed buckets, percentiles are interpolated within the
+    bucket they fall in.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def to_json(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time_ns()
+        self.duration = None
+        self.error = None
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self):
+        self.duration = time.perf_counter() - self._started
+
+    def to_json(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start / 1e9,
+            "duration_ms": self.duration * 1000,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            # SPAN_KIND_INTERNAL
+            "kind": 1,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.start + int(self.duration * 1e9)),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in self.attributes.items()
+                if value is not None
+            ],
+            # STATUS_CODE_OK or STATUS_CODE_ERROR
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # int64 are strings in OTLP/JSON
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class JsonLinesExporter:
+    """Append every finished span as one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", buffering=1)
+        self._lock = threading.Lock()
+
+    def format(self, span):
+        return span.to_json()
+
+    def export(self, span):
+        line = json.dumps(self.format(span), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class OTLPJsonExporter(JsonLinesExporter):
+    """
+    Append every finished span as an OTLP/JSON export request, one per line,
+    the format the OpenTelemetry collector file receiver reads.
+    """
+
+    def __init__(self, path, service_name="heydocker"):
+        super().__init__(path)
+        self.resource = {
+            "attributes": [
+                {"key": "service.name", "value": {"stringValue": service_name}}
+            ]
+        }
+
+    def format(self, span):
+        return {
+            "resourceSpans": [
+                {
+                    "resource": self.resource,
+                    "scopeSpans": [
+                        {"scope": {"name": "heydocker"}, "spans": [span.to_otlp()]}
+                    ],
+                }
+            ]
+        }
+
+
+EXPORTERS = {"jsonl": JsonLinesExporter, "otlp": OTLPJsonExporter}
+
+
+def create_exporter(format, path):
+    """
+    :param format: "jsonl" or "otlp".
+    :type format: str
+    :param path: File the spans are appended to.
+    :type path: str
+    """
+    if format not in EXPORTERS:
+        raise ValueError(f"Unknown trace format: {format}")
+    return EXPORTERS[format](path)
+
+
+class Tracer:
+    """
+    Spans around the stages of answering a message.
+
+    The current span is kept in a context variable, so spans opened in tasks
+    and in the tool thread pool are children of the span that started them.
+    Every finished span is counted in a histogram per span name and passed to
+    the exporters.
+    """
+
+    def __init__(self):
+        self.exporters = []
+        self.histograms = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        parent = _current_span.get()
+        span = Span(
+            name,
+            parent.trace_id if parent else secrets.token_hex(16),
+            parent.span_id if parent else None,
+            attributes,
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+            self._record(span)
+
+    def _record(self, span):
+        with self._lock:
+            histogram = self.histograms.get(span.name)
+            if histogram is None:
+                histogram = self.histograms[span.name] = Histogram()
+            histogram.observe(span.duration)
+            if span.error:
+                self.errors[span.name] = self.errors.get(span.name, 0) + 1
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logger.warning(f"Failed to export span {span.name}: {e}")
+
+    def histogram_snapshot(self):
+        """
+        Copy the histogram and error count of every span name.
+
+        :return: ``(histogram, errors)`` keyed by span name.
+        :rtype: dict
+        """
+        with self._lock:
+            snapshot = {}
+            for name, histogram in sorted(self.histograms.items()):
+                copy = Histogram(histogram.buckets)
+                copy.counts = list(histogram.counts)
+                copy.count, copy.sum, copy.max = histogram.count, histogram.sum, histogram.max
+                snapshot[name] = (copy, self.errors.get(name, 0))
+            return snapshot
+
+    def stats(self):
+        """
+        Get the count, total, maximum and percentiles of the durations per span
+        name, in seconds.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {name: h.to_json() for name, h in sorted(self.histograms.items())}
+
+    def format_stats(self):
+        """Durations per span name as a text table, in milliseconds."""
+        stats = self.stats()
+        if not stats:
+            return "No requests traced yet."
+        width = max(len(name) for name in ["span", *stats])
+        lines = [f"{'span':<{width}} {'n':>6} {'p50':>7} {'p95':>7} {'p99':>7}"]
+        for name, row in stats.items():
+            lines.append(
+                f"{name:<{width}} {row['count']:>6}"
+                f" {row['p50'] * 1000:>7.0f} {row['p95'] * 1000:>7.0f}"
+                f" {row['p99'] * 1000:>7.0f}"
+            )
+        return "\n".join(lines)
+
+    def close(self):
+        for exporter in self.exporters:
+            exporter.close()
+
+
+tracer = Tracer()
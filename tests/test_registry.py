@@ -0,0 +1,23 @@
+import pytest
+
+from heydocker.functions import functions
+from heydocker.functions.registry import ToolRegistry
+
+registry = ToolRegistry(functions)
+
+
+def test_null_arguments_are_omitted():
+    kwargs = registry.decode_arguments(
+        "get_container", '{"container_name": "api", "host": null}'
+    )
+    assert kwargs == {"container_name": "api"}
+
+
+def test_wrong_type_is_rejected():
+    with pytest.raises(ValueError, match="must be string"):
+        registry.decode_arguments("get_container", '{"container_name": 1}')
+
+
+def test_unknown_argument_is_rejected():
+    with pytest.raises(ValueError, match="Unknown argument"):
+        registry.decode_arguments("list_containers", '{"all": true}')
@@ -0,0 +1,50 @@
+import pytest
+
+from heydocker.functions.router import IntentRouter
+
+router = IntentRouter()
+
+
+@pytest.mark.parametrize(
+    "message,tool",
+    [
+        ("list containers", "list_containers"),
+        ("docker ps -a", "list_containers"),
+        ("what containers are running?", "list_containers"),
+        ("which images do I have", "list_images"),
+        ("show stats of container api", "stats_container"),
+    ],
+)
+def test_routes_read_only_commands(message, tool):
+    intent, _ = router.route(message)
+    assert intent.tool == tool
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "stop running containers",
+        "stop all running containers",
+        "restart running containers",
+        "remove the containers list",
+        "please kill the containers",
+        "docker rm containers",
+        "pull images",
+        "prune volumes",
+    ],
+)
+def test_action_verbs_go_to_the_model(message):
+    assert router.route(message) is None
+
+
+@pytest.mark.parametrize(
+    "message",
+    ["list containers on prod", "how full is the disk on prod", "docker ps on PROD"],
+)
+def test_messages_naming_a_host_go_to_the_model(message):
+    assert IntentRouter(hosts=["prod"]).route(message) is None
+
+
+def test_host_names_do_not_block_other_messages():
+    intent, _ = IntentRouter(hosts=["prod"]).route("list containers")
+    assert intent.tool == "list_containers"